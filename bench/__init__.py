@@ -0,0 +1 @@
+"""Benchmarks for plseg (run modules with python -m bench.<name>)."""
@@ -0,0 +1,97 @@
+"""Time hot functions and end-to-end segmentation on synthetic sequences.
+
+For every combination of ROI size and number of plants, generates a
+synthetic tray sequence (see bench.synth), times each stage of the
+pipeline on its frames, and then times plabel.dosegment on the whole
+sequence. Prints results as JSON, to be compared between commits.
+Run from the top-level directory of the repository as `python -m bench`.
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+import plseg.utils as ut
+import plseg.label as plbl
+from plseg.costs import unary, pairwise
+from plabel import dosegment, loadopts
+from .synth import sequence, writeseq
+
+
+def besttime(func, repeat):
+    """Minimum time taken by func() over repeat runs, and its last result."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = func()
+        best = min(best, time.perf_counter()-start)
+    return best, res
+
+
+def hotfuncs(frames, fnames, alims, opt, repeat):
+    """Time each pipeline stage on the last two frames of a sequence."""
+    imgp = frames[-2][alims[0][0]:alims[0][1], alims[1][0]:alims[1][1]]
+    prev = plbl.label(imgp, None, opt)
+    img = frames[-1]
+
+    times = {}
+    times['imread'], _ = besttime(lambda: ut.imread(fnames[-1]), repeat)
+    times['crop_align'], imgc = besttime(
+        lambda: ut.crop_align(img, imgp), repeat)
+    times['unary'], _ = besttime(lambda: unary(imgc, opt), repeat)
+    times['pairwise'], _ = besttime(lambda: pairwise(imgc, opt), repeat)
+    times['binarycut'], (binary, ucost0, ewts) = besttime(
+        lambda: plbl.binarycut(imgc, prev, opt), repeat)
+    times['separateconnect'], seg = besttime(
+        lambda: plbl.separateconnect(binary, prev, ucost0, ewts, opt),
+        repeat)
+    times['label'], _ = besttime(lambda: plbl.label(imgc, prev, opt), repeat)
+    times['visualize'], _ = besttime(lambda: ut.visualize(imgc, seg), repeat)
+    return times, int(np.amax(seg))
+
+
+def main():
+    """Run benchmarks."""
+    opts = argparse.ArgumentParser(description=__doc__)
+    opts.add_argument('--sizes', type=int, nargs='+', default=[500, 1000],
+                      help="ROI sizes (frames are square, 10%% larger)")
+    opts.add_argument('--plants', type=int, nargs='+', default=[12, 48],
+                      help="Numbers of plants per tray")
+    opts.add_argument('--frames', type=int, default=8)
+    opts.add_argument('--repeat', type=int, default=3)
+    opts.add_argument('--seed', type=int, default=0)
+    opts.add_argument('--no-e2e', action='store_true',
+                      help="Skip end-to-end dosegment runs.")
+    args = opts.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for nplants in args.plants:
+            frames = sequence([size*11//10]*2, args.frames, nplants,
+                              args.seed)[0]
+            res = {'size': size, 'plants': nplants}
+            with tempfile.TemporaryDirectory() as tdir:
+                writeseq(tdir+'/src', tdir+'/tgt', frames, size//20)
+                sopts = loadopts(tdir+'/tgt')
+                fnames = ut.getimglist(tdir+'/src')
+                res['sec'], res['labels'] = hotfuncs(
+                    frames, fnames, sopts[4], sopts[5], args.repeat)
+                if not args.no_e2e:
+                    start = time.perf_counter()
+                    dosegment(*sopts, progress=False, ckptevery=0)
+                    secs = time.perf_counter()-start
+                    res['sec']['dosegment_per_frame'] = secs/args.frames
+            results.append(res)
+
+    print(json.dumps({'benchmark': 'suite', 'args': vars(args),
+                      'python': sys.version.split()[0],
+                      'numpy': np.__version__,
+                      'machine': platform.machine(),
+                      'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark speed and accuracy of utils.crop_align search methods.
+
+Aligns synthetic frames with known random camera shifts, and prints a JSON
+summary of time per frame and offset errors for each method, relative to
+the true shift and to the exhaustive full-resolution search.
+"""
+
+import json
+import time
+import argparse
+import numpy as np
+import plseg.utils as ut
+from .synth import synthframe
+
+
+def main():
+    """Run benchmark."""
+    opts = argparse.ArgumentParser(description=__doc__)
+    opts.add_argument('--size', type=int, nargs=2, default=[1000, 1500])
+    opts.add_argument('--frames', type=int, default=10)
+    opts.add_argument('--jitter', type=int, default=20)
+    opts.add_argument('--levels', type=int, default=3)
+    opts.add_argument('--radius', type=int, default=32)
+    opts.add_argument('--seed', type=int, default=0)
+    args = opts.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    big = synthframe(rng, [args.size[0]+2*args.jitter,
+                           args.size[1]+2*args.jitter])
+    _m = [args.size[0]//10, args.size[1]//10]
+    ref = [args.jitter+_m[0], args.jitter+_m[1]]
+    imgc = big[ref[0]:(ref[0]+args.size[0]-2*_m[0]),
+               ref[1]:(ref[1]+args.size[1]-2*_m[1])]
+
+    frames, truth = [], []
+    for _ in range(args.frames):
+        _dy, _dx = rng.randint(-args.jitter, args.jitter+1, 2)
+        frame = big[(args.jitter+_dy):(args.jitter+_dy+args.size[0]),
+                    (args.jitter+_dx):(args.jitter+_dx+args.size[1])]
+        frames.append(frame)
+        truth.append([_m[0]-_dy, _m[1]-_dx])
+
+    methods = {'full': {'method': 'full'},
+               'full-radius': {'method': 'full', 'radius': args.radius},
+               'pyramid': {'method': 'pyramid', 'levels': args.levels},
+               'pyramid-radius': {'method': 'pyramid', 'levels': args.levels,
+                                  'radius': args.radius}}
+    offsets, results = {}, {}
+    for name, kwargs in methods.items():
+        center = _m if 'radius' in kwargs else None
+        start, offsets[name] = time.time(), []
+        for frame in frames:
+            offsets[name].append(ut.crop_align(frame, imgc, center=center,
+                                               retoff=True, **kwargs)[1])
+        secs = (time.time()-start)/len(frames)
+        err = np.abs(np.asarray(offsets[name]) - np.asarray(truth))
+        dfull = np.abs(np.asarray(offsets[name])
+                       - np.asarray(offsets['full']))
+        results[name] = {'sec_per_frame': secs,
+                         'speedup': results['full']['sec_per_frame']/secs
+                         if name != 'full' else 1.0,
+                         'max_err_px': int(np.amax(err)),
+                         'frac_exact': float(np.mean(np.all(err == 0, 1))),
+                         'max_diff_from_full_px': int(np.amax(dfull))}
+
+    print(json.dumps({'benchmark': 'crop_align', 'args': vars(args),
+                      'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Benchmark coarse-to-fine binary segmentation against a full-scale cut.
+
+Runs the binary segmentation stage of plseg.label on a synthetic frame at
+full resolution, and coarse-to-fine with different pyramid depths and band
+widths, and prints a JSON summary of time taken and the fraction of pixels
+(and of foreground pixels) where the results disagree.
+"""
+
+import json
+import time
+import argparse
+import numpy as np
+from plseg.label import Options, binarycut
+from .synth import synthframe
+
+
+def main():
+    """Run benchmark."""
+    opts = argparse.ArgumentParser(description=__doc__)
+    opts.add_argument('--size', type=int, nargs=2, default=[1500, 1500])
+    opts.add_argument('--levels', type=int, nargs='+', default=[1, 2, 3])
+    opts.add_argument('--bands', type=int, nargs='+', default=[2, 4, 8])
+    opts.add_argument('--seed', type=int, default=0)
+    args = opts.parse_args()
+
+    img = synthframe(np.random.RandomState(args.seed), args.size)
+
+    start = time.time()
+    full = binarycut(img, None, Options())[0]
+    results = {'full': {'sec': time.time()-start}}
+
+    for levels in args.levels:
+        for band in args.bands:
+            start = time.time()
+            c2f = binarycut(img, None, Options(c2flevels=levels,
+                                               c2fband=band))[0]
+            secs = time.time()-start
+            results[f'levels{levels}-band{band}'] = {
+                'sec': secs, 'speedup': results['full']['sec']/secs,
+                'disagreement': float(np.mean(c2f != full)),
+                'fg_disagreement': float(np.sum(c2f != full)
+                                         / max(1, np.sum(full)))}
+
+    print(json.dumps({'benchmark': 'coarse-to-fine', 'args': vars(args),
+                      'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Deterministic synthetic overhead tray sequences.
+
+Plants are drawn as rosettes of elliptical leaves, centred on a jittered
+grid over a soil-coloured texture. Leaves grow over the sequence, so that
+neighbouring plants come to touch and merge, and each frame is cropped from
+a larger canvas at a random offset to simulate camera jitter.
+"""
+
+import os
+import json
+import numpy as np
+from scipy.ndimage import gaussian_filter
+from skimage.io import imsave
+
+
+def soil(rng, shape):
+    """Soil-coloured texture with coarse and fine variation, in [0, 1]."""
+    tex = 0.7*gaussian_filter(rng.rand(*shape), 8) \
+        + 0.3*gaussian_filter(rng.rand(*shape), 1.5)
+    tex = (tex - tex.min()) / (tex.max() - tex.min())
+    return np.stack([0.35+0.3*tex, 0.25+0.22*tex, 0.17+0.12*tex], -1)
+
+
+def plants(rng, shape, nplants):
+    """Random rosette parameters for nplants on a jittered grid."""
+    nrows = max(1, int(round(np.sqrt(nplants*shape[0]/shape[1]))))
+    ncols = int(np.ceil(nplants/nrows))
+    step = [shape[0]/nrows, shape[1]/ncols]
+    plist = []
+    for idx in range(nplants):
+        _r, _c = idx // ncols, idx % ncols
+        nleaves = rng.randint(3, 7)
+        plist.append({
+            'center': [(_r+0.5+rng.uniform(-0.15, 0.15))*step[0],
+                       (_c+0.5+rng.uniform(-0.15, 0.15))*step[1]],
+            'angles': rng.uniform(0, 2*np.pi) + np.arange(nleaves)
+                      * 2*np.pi/nleaves + rng.uniform(-0.3, 0.3, nleaves),
+            'length': min(step)*rng.uniform(0.55, 0.8),
+            'color': [rng.uniform(0.1, 0.25), rng.uniform(0.5, 0.7),
+                      rng.uniform(0.1, 0.2)]})
+    return plist
+
+
+def drawplants(img, plist, grow):
+    """Draw plants in-place, with leaves at fraction grow of full length."""
+    for plant in plist:
+        length = max(1., grow*plant['length'])
+        _cy, _cx = plant['center']
+        _y1, _x1 = int(max(0, _cy-length)), int(max(0, _cx-length))
+        _y2 = int(min(img.shape[0], _cy+length+1))
+        _x2 = int(min(img.shape[1], _cx+length+1))
+        if _y2 <= _y1 or _x2 <= _x1:
+            continue
+        _y, _x = np.mgrid[_y1:_y2, _x1:_x2]
+        _y, _x = _y - _cy, _x - _cx
+        shade = np.zeros(_y.shape)
+        for ang in plant['angles']:
+            # Position along and across leaf, relative to its centre
+            along = _y*np.sin(ang) + _x*np.cos(ang) - 0.5*length
+            across = -_y*np.cos(ang) + _x*np.sin(ang)
+            dist = (along/(0.5*length))**2 + (across/(0.18*length))**2
+            shade = np.maximum(shade, 1 - dist)
+        mask = shade > 0
+        img[_y1:_y2, _x1:_x2][mask] = np.asarray(plant['color']) \
+            * (0.75 + 0.25*shade[mask, None])
+
+
+def sequence(shape, nframes, nplants, seed=0, jitter=10, grow=(0.3, 1.0)):
+    """Generate nframes uint8 frames of a tray with nplants plants.
+
+    Leaves grow linearly from fraction grow[0] to grow[1] of their full
+    length over the sequence. Also returns the (dy, dx) camera jitter of
+    each frame, relative to the canvas centre.
+    """
+    rng = np.random.RandomState(seed)
+    cshape = [shape[0]+2*jitter, shape[1]+2*jitter]
+    background = soil(rng, cshape)
+    plist = plants(rng, cshape, nplants)
+
+    frames, shifts = [], []
+    for t in range(nframes):
+        img = background.copy()
+        drawplants(img, plist, grow[0] + (grow[1]-grow[0])
+                   * t/max(1, nframes-1))
+        _dy, _dx = rng.randint(-jitter, jitter+1, 2) if t > 0 else (0, 0)
+        img = img[(jitter+_dy):(jitter+_dy+shape[0]),
+                  (jitter+_dx):(jitter+_dx+shape[1])]
+        img = img * rng.uniform(0.95, 1.05) + 0.015*rng.randn(*img.shape)
+        frames.append((np.clip(img, 0, 1)*255).astype(np.uint8))
+        shifts.append([int(_dy), int(_dx)])
+    return frames, shifts
+
+
+def synthframe(rng, shape, nplants=20):
+    """Single frame with nplants partly grown plants."""
+    img = soil(rng, shape)
+    drawplants(img, plants(rng, shape, nplants), 0.7)
+    img = img + 0.015*rng.randn(*img.shape)
+    return (np.clip(img, 0, 1)*255).astype(np.uint8)
+
+
+def writeseq(srcdir, tgtdir, frames, margin=None, ext='png'):
+    """Save frames to srcdir, and crop options for plabel.py to tgtdir.
+
+    The ROI excludes margin pixels (default: 5% of size) on every side.
+    """
+    os.makedirs(srcdir, exist_ok=True)
+    os.makedirs(tgtdir, exist_ok=True)
+    for t, frame in enumerate(frames):
+        imsave(f'{srcdir}/f{t:04d}.{ext}', frame, check_contrast=False)
+
+    _h, _w = frames[0].shape[:2]
+    if margin is None:
+        margin = max(1, min(_h, _w)//20)
+    with open(tgtdir+'/caopt.json', 'w') as _f:
+        json.dump({'source': os.path.abspath(srcdir), 'scale': 100,
+                   'skip': 0, 'xlim': [margin, _w-margin],
+                   'ylim': [margin, _h-margin]}, _f)
@@ -5,28 +5,97 @@
 import sys
 import os
 import json
+import time
+import cProfile
+import argparse
+from glob import glob
+from functools import partial
+from dataclasses import asdict
+from multiprocessing import Pool
 from tqdm import tqdm
 import numpy as np
-from skimage.io import imsave
+from skimage.io import imread, imsave
 import plseg.label as plbl
 import plseg.utils as ut
+import plseg.volume as vol
+import plseg.trace as trace
+import plseg.frames as frm
+import plseg.stats as st
+from plseg.stack import StackWriter
+from plseg.pipeline import prefetch, Writer
 
 
 def getargopts():
-    """Get directory from command line and load config files."""
+    """Parse command line arguments."""
+    opts = argparse.ArgumentParser(
+        description='Crop and segment sequence of plant images. '
+        + 'See README.md for instructions.')
+    opts.add_argument('--batch', action='store_true',
+                      help="Treat target as a base directory, and segment "
+                      + "every sub-directory with a caopt.json.")
+    opts.add_argument('--workers', type=int, default=os.cpu_count(),
+                      help="Number of sequences to segment in parallel in "
+                      + "batch mode (default: number of cores)")
+    opts.add_argument('--force', action='store_true',
+                      help="In batch mode, also re-segment sequences whose "
+                      + "labels.npz is newer than their options.")
+    opts.add_argument('--prefetch', type=int, default=4,
+                      help="Number of frames to read ahead, and of image "
+                      + "saves to queue, in background threads (default 4, "
+                      + "0 to disable)")
+    opts.add_argument('--checkpoint', type=int, default=50,
+                      help="Save tracking state every these many frames, "
+                      + "to resume from if interrupted (default 50, 0 to "
+                      + "disable)")
+    opts.add_argument('--no-resume', action='store_true',
+                      help="Ignore any existing checkpoint and start over.")
+    opts.add_argument('--from-frame', type=int, default=None,
+                      help="Only re-segment frames from this one (0-based, "
+                      + "after skip) onwards, starting from existing "
+                      + "results for the frame before.")
+    opts.add_argument('--labels', choices=['npz', 'stack', 'both'],
+                      default='npz',
+                      help="Save labels as labels.npz (default), as a "
+                      + "labels.stk stack file that can be read one frame "
+                      + "at a time, or both.")
+    opts.add_argument('--align', choices=['full', 'pyramid'],
+                      default='full',
+                      help="Search for frame alignment exhaustively at full "
+                      + "resolution (default), or coarse-to-fine.")
+    opts.add_argument('--align-radius', type=int, default=None,
+                      help="Only search for alignment within these many "
+                      + "pixels of the previous frame's offset.")
+    opts.add_argument('--stack', choices=['none', 'crops', 'all'],
+                      default='none',
+                      help="Save aligned crops to a single crops.stk file "
+                      + "instead of separate -crop images, still saving "
+                      + "-seg images (crops), or also save visualizations "
+                      + "to segs.stk instead of -seg images (all). Use "
+                      + "plexport.py to export image files.")
+    opts.add_argument('--trace', action='store_true',
+                      help="Write time taken by each stage, and counts of "
+                      + "components, splits, joins, and cuts, for every "
+                      + "frame to trace.jsonl in the target directory.")
+    opts.add_argument('--profile', action='store_true',
+                      help="Save cProfile stats of segmentation to "
+                      + "profile.pstats in the target directory.")
+    opts.add_argument('target', help="Target directory (or base target "
+                      + "directory with --batch).")
+    args = opts.parse_args()
+    args.target = args.target.rstrip('/')
 
-    if len(sys.argv) != 2:
-        sys.stderr.write(f'USAGE: {sys.argv[0]} targetdir\n')
-        sys.stderr.write(f'Crop and segment sequence of plant images.\n')
+    if args.batch and args.from_frame is not None:
+        opts.error('--from-frame cannot be used with --batch.')
+    if not args.batch and not os.path.isfile(args.target+'/caopt.json'):
+        sys.stderr.write(f'{args.target}/caopt.json does not exist.\n')
         sys.stderr.write('See README.md for instructions.\n')
         sys.exit(255)
 
-    tgtdir = sys.argv[1].rstrip('/')
+    return args
 
-    if not os.path.isfile(tgtdir+'/caopt.json'):
-        sys.stderr.write(f'{tgtdir}/caopt.json does not exist.\n')
-        sys.stderr.write('See README.md for instructions.\n')
-        sys.exit(255)
+
+def loadopts(tgtdir):
+    """Load crop and segmentation options for a target directory."""
 
     with open(tgtdir+'/caopt.json', 'r') as _f:
         caopt = json.load(_f)
@@ -44,40 +113,299 @@ def getargopts():
     return srcdir, tgtdir, scale, skip, (ylim, xlim), opt
 
 
-def dosegment(srcdir, tgtdir, scale, skip, alims, opt):
-    """Main segment function."""
+def labelsfile(tgtdir):
+    """Get the most recently saved labels file, if any."""
+    return vol.find(tgtdir)
+
+
+def isdone(tgtdir):
+    """Check if labels are newer than the options they were computed with."""
+
+    lfile = labelsfile(tgtdir)
+    if lfile is None:
+        return False
+    ltime = os.path.getmtime(lfile)
+    for _f in ['caopt.json', 'segopt.json']:
+        if os.path.isfile(tgtdir+'/'+_f) and \
+           os.path.getmtime(tgtdir+'/'+_f) >= ltime:
+            return False
+    return True
+
+
+def outname(fname):
+    """Split output file name prefix and extension from source file."""
+    ofname = (fname.split('/')[-1]).split('.')
+    return '.'.join(ofname[:-1]), ofname[-1]
+
+
+def ckptconfig(flist, scale, alims, opt, align):
+    """Description of inputs a checkpoint is valid for."""
+    return json.dumps({'flist': [f.split('/')[-1] for f in flist],
+                       'scale': scale, 'alims': alims, 'opt': asdict(opt),
+                       'align': align}, sort_keys=True)
+
+
+def saveckpt(tgtdir, config, nframes, seg, imgc, offset):
+    """Save tracking state after the first nframes frames."""
+    tmpname = f'{tgtdir}/checkpoint.tmp.npz'
+    np.savez_compressed(tmpname, config=config, nframes=nframes,
+                        seg=seg, imgc=imgc,
+                        offset=[] if offset is None else offset)
+    os.replace(tmpname, f'{tgtdir}/checkpoint.npz')
+
+
+def loadckpt(tgtdir, config):
+    """Load saved tracking state, if it exists and matches config."""
+    if not os.path.isfile(f'{tgtdir}/checkpoint.npz') or \
+       not os.path.isfile(f'{tgtdir}/labels.part.stk'):
+        return None
+    ckpt = np.load(f'{tgtdir}/checkpoint.npz')
+    if str(ckpt['config']) != config:
+        return None
+
+    nframes = int(ckpt['nframes'])
+    try:
+        writer = vol.LabelWriter(f'{tgtdir}/labels.part.stk', True, nframes)
+    except ValueError:  # Labels written so far are incomplete
+        return None
+    offset = [int(f) for f in ckpt['offset']] or None
+    return nframes, writer, ckpt['seg'], ckpt['imgc'], offset
+
+
+def loadfrom(tgtdir, flist, start):
+    """Restore state from existing results to re-segment from start."""
+    if start < 1 or start >= len(flist):
+        raise ValueError('Can only re-segment from frames 1 to '
+                         + f'{len(flist)-1}.')
+
+    lfile = labelsfile(tgtdir)
+    if lfile is None:
+        raise ValueError(f'No existing labels in {tgtdir}.')
+    labels = vol.load(lfile)
+    if labels.shape[-1] != len(flist):
+        raise ValueError(f'{lfile} has {labels.shape[-1]} frames, '
+                         + f'expected {len(flist)}.')
+
+    writer = vol.LabelWriter(f'{tgtdir}/labels.part.stk')
+    for i in range(start):
+        writer.append(labels[:, :, i])
+    if os.path.isfile(frm.stackname(tgtdir)):
+        imgc = frm.Frames(tgtdir)[start-1]
+    else:
+        ofn, oext = outname(flist[start-1])
+        imgc = imread(f'{tgtdir}/{ofn}-crop.{oext}')
+    return writer, labels[:, :, start-1].astype(np.int32), imgc, None
+
+
+def openstacks(tgtdir, stack, start):
+    """Open stack files to save crops (and seg images) from frame start.
+
+    Stack files of kinds not being saved are removed, unless continuing
+    from a later frame, in which case this is an error.
+    """
+    kinds = {'none': [], 'crops': ['crop'], 'all': ['crop', 'seg']}[stack]
+    stacks = {}
+    for kind in ['crop', 'seg']:
+        fname = frm.stackname(tgtdir, kind)
+        if kind in kinds:
+            stacks[kind] = StackWriter(fname, start > 0, start)
+            if stacks[kind].nframes != start:
+                raise ValueError(f'{fname} does not have the first {start} '
+                                 + 'frames.')
+        elif os.path.isfile(fname):
+            if start > 0:
+                raise ValueError(f'{fname} exists: use the same --stack '
+                                 + 'option as before to continue.')
+            os.remove(fname)
+    return stacks
+
+
+def savelabels(tgtdir, lmax, lformat):
+    """Save labels written to partial stack file in final format(s)."""
+    part = f'{tgtdir}/labels.part.stk'
+    if lformat in ['npz', 'both']:
+        store = vol.LabelStore(part)
+        vol.savenpz(f'{tgtdir}/labels.npz', store, store.shape,
+                    vol.npzdtype(lmax))
+    if lformat in ['stack', 'both']:
+        os.replace(part, f'{tgtdir}/labels.stk')
+    else:
+        os.remove(part)
+
+    # Remove labels left by earlier runs, so they are never read instead
+    stale = ['labels.plr']
+    if lformat == 'npz':
+        stale.append('labels.stk')
+    elif lformat == 'stack':
+        stale.extend(['labels.npz', 'labels.mmap.npy'])
+    for fname in stale:
+        if os.path.isfile(f'{tgtdir}/{fname}'):
+            os.remove(f'{tgtdir}/{fname}')
+
+
+def dosegment(srcdir, tgtdir, scale, skip, alims, opt, progress=True,
+              depth=4, ckptevery=50, resume=True, fromframe=None,
+              lformat='npz', align='full', aradius=None, stack='none',
+              dotrace=False, profile=False):
+    """Main segment function.
+
+    Keyword arguments match plabel.py's options (see SEGOPT.md), and depth=0
+    does everything serially.
+    """
 
     flist = ut.getimglist(srcdir)
     if skip > 0:
         flist = flist[skip:]
     nfiles = len(flist)
+    config = ckptconfig(flist, scale, alims, opt, [align, aradius, stack])
 
-    labels, seg, imgc = None, None, None
-    for i in tqdm(range(nfiles)):
-        fname = flist[i]
-        img = ut.imread(fname, scale)
-        ofname = (fname.split('/')[-1]).split('.')
-        ofn, oext = '.'.join(ofname[:-1]), ofname[-1]
-
-        if i == 0:
-            imgc = img[alims[0][0]:alims[0][1], alims[1][0]:alims[1][1], :]
-            labels = np.zeros([imgc.shape[0], imgc.shape[1], len(flist)],
-                              dtype=np.int32)
-        else:
-            imgc = ut.crop_align(img, imgc)
-        imsave(f'{tgtdir}/{ofn}-crop.{oext}', imgc)
-
-        seg = plbl.label(imgc, seg, opt)
-        labels[:, :, i] = seg
-        imsave(f'{tgtdir}/{ofn}-seg.{oext}', ut.visualize(imgc, seg),
-               check_contrast=False)
-
-    if(np.amax(labels) <= 255):
-        labels = labels.astype(np.uint8)
-    else:
-        labels = labels.astype(np.int16)
-    np.savez_compressed(f'{tgtdir}/labels.npz', labels=labels)
+    def _read(fname):
+        start = time.perf_counter()
+        return ut.imread(fname, factor=scale), time.perf_counter()-start
+
+    def _saveseg(fname, imgc, seg):
+        imsave(fname, ut.visualize(imgc, seg), check_contrast=False)
+
+    def _stackseg(segs, imgc, seg, **meta):
+        segs.append(ut.visualize(imgc, seg), **meta)
+
+    state = None
+    if fromframe is not None:
+        state = (fromframe,) + loadfrom(tgtdir, flist, fromframe)
+    elif resume:
+        state = loadckpt(tgtdir, config)
+    if state is None:
+        state = (0, vol.LabelWriter(f'{tgtdir}/labels.part.stk'),
+                 None, None, None)
+    start, labels, seg, imgc, offset = state
+    stacks = openstacks(tgtdir, stack, start)
+    stats = st.Builder()
+    if start > 0:
+        labels.flush()
+        for frame in vol.LabelStore(f'{tgtdir}/labels.part.stk'):
+            stats.append(frame)
+
+    if dotrace:
+        trace.start(f'{tgtdir}/trace.jsonl', append=start > 0)
+    prof = cProfile.Profile() if profile else None
+    if prof is not None:
+        prof.enable()
+
+    try:
+        frames = prefetch(_read, flist[start:], depth)
+        # Frames are appended to stacks and stats in order, by a single thread
+        with Writer(depth) as writer, Writer(depth, 1) as stacker, labels:
+            for i, (img, secs) in enumerate(tqdm(frames, total=nfiles,
+                                                 initial=start,
+                                                 disable=not progress), start):
+                ofn, oext = outname(flist[i])
+                trace.frame(i, file=flist[i].split('/')[-1])
+                trace.add('decode', secs)
+
+                with trace.stage('align'):
+                    if i == 0:
+                        imgc = img[alims[0][0]:alims[0][1],
+                                   alims[1][0]:alims[1][1], :]
+                        offset = [alims[0][0], alims[1][0]]
+                    else:
+                        imgc, offset = ut.crop_align(
+                            img, imgc, align, offset,
+                            aradius if offset is not None else None,
+                            retoff=True)
+                if 'crop' in stacks:
+                    stacker.submit(trace.timed(stacks['crop'].append, 'stack'),
+                                   imgc, name=ofn, ext=oext)
+                else:
+                    writer.submit(trace.timed(imsave, 'imsave'),
+                                  f'{tgtdir}/{ofn}-crop.{oext}', imgc)
+
+                with trace.stage('label'):
+                    seg = plbl.label(imgc, seg, opt)
+                with trace.stage('store'):
+                    labels.append(seg)
+                stacker.submit(trace.timed(stats.append, 'stats'), seg)
+                if 'seg' in stacks:
+                    stacker.submit(trace.timed(_stackseg, 'stack'),
+                                   stacks['seg'], imgc, seg, name=ofn,
+                                   ext=oext)
+                else:
+                    writer.submit(trace.timed(_saveseg, 'imsave'),
+                                  f'{tgtdir}/{ofn}-seg.{oext}', imgc, seg)
+
+                if ckptevery > 0 and (i+1) % ckptevery == 0 and i+1 < nfiles:
+                    writer.flush()
+                    stacker.flush()
+                    for stk in stacks.values():
+                        stk.flush()
+                    labels.flush()
+                    saveckpt(tgtdir, config, i+1, seg, imgc, offset)
+                    trace.flush()
+
+        for stk in stacks.values():
+            stk.close()
+        trace.flush()
+    finally:
+        if prof is not None:
+            prof.disable()
+        # If a frame failed, records since the last checkpoint are dropped,
+        # as resuming segments those frames again.
+        trace.stop(discard=True)
+    if prof is not None:
+        prof.dump_stats(f'{tgtdir}/profile.pstats')
+
+    savelabels(tgtdir, labels.lmax, lformat)
+    stats.save(f'{tgtdir}/stats.npz')
+    if os.path.isfile(f'{tgtdir}/checkpoint.npz'):
+        os.remove(f'{tgtdir}/checkpoint.npz')
+
+
+def runone(tgtdir, **kwargs):
+    """Segment one sequence in a batch worker, and time it."""
+
+    start = time.time()
+    try:
+        dosegment(*loadopts(tgtdir), progress=False, **kwargs)
+        return tgtdir, None, time.time()-start
+    except Exception as err:  # Report, but don't bring down the whole batch
+        return tgtdir, f'{type(err).__name__}: {err}', time.time()-start
+
+
+def dobatch(basedir, nworkers, force=False, **kwargs):
+    """Segment all sequences in a base target directory in parallel."""
+
+    dlist = sorted(['/'.join(f.split('/')[:-1])
+                    for f in glob(basedir+'/*/caopt.json')])
+    todo = [d for d in dlist if force or not isdone(d)]
+    print(f'Found {len(dlist)} sequences, {len(dlist)-len(todo)} '
+          + 'already done, segmenting the rest.')
+
+    results = []
+    with Pool(max(1, min(nworkers, len(todo)))) as pool:
+        jobs = pool.imap_unordered(partial(runone, **kwargs), todo)
+        for res in tqdm(jobs, total=len(todo)):
+            results.append(res)
+
+    results = sorted(results)
+    failed = [r for r in results if r[1] is not None]
+    for tgtdir, err, secs in results:
+        status = 'FAILED' if err is not None else 'done'
+        print(f'{secs:9.1f}s  {status:6s}  {tgtdir}')
+    print(f'{len(results)-len(failed)} done, {len(failed)} failed, '
+          + f'{sum(r[2] for r in results):.1f}s total.')
+    for tgtdir, err, _ in failed:
+        sys.stderr.write(f'{tgtdir}: {err}\n')
+
+    return len(failed)
 
 
 if __name__ == "__main__":
-    dosegment(*getargopts())
+    ARGS = getargopts()
+    KWARGS = {'depth': ARGS.prefetch, 'ckptevery': ARGS.checkpoint,
+              'resume': not ARGS.no_resume, 'lformat': ARGS.labels,
+              'align': ARGS.align, 'aradius': ARGS.align_radius,
+              'stack': ARGS.stack, 'dotrace': ARGS.trace,
+              'profile': ARGS.profile}
+    if ARGS.batch:
+        sys.exit(1 if dobatch(ARGS.target, ARGS.workers, ARGS.force,
+                              **KWARGS) else 0)
+    dosegment(*loadopts(ARGS.target), fromframe=ARGS.from_frame, **KWARGS)
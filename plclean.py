@@ -12,9 +12,13 @@ def getargopts():
     opts.add_argument('--port', type=int,
                       help="Port to listen to (default 8888)",
                       default=8888)
+    opts.add_argument('--prefetch', type=int, default=2048,
+                      help="Memory budget (MB) for reading labels of "
+                      + "adjacent sequences in advance (default 2048, "
+                      + "0 to disable)")
     opts.add_argument('basedir', help="Base (target) directory.")
     args = opts.parse_args()
-    return args.basedir, args.port
+    return args.basedir, args.port, args.prefetch
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Convert labels between labels.npz and the compact labels.plr format."""
+
+import sys
+import os
+import argparse
+from glob import glob
+from tqdm import tqdm
+import plseg.volume as vol
+
+
+def getargopts():
+    """Parse command line arguments."""
+    opts = argparse.ArgumentParser(
+        description='Convert labels saved by plabel.py to a compact '
+        + 'labels.plr file, which stores the mask of each plant in each '
+        + 'frame within its bounding box, or (with --dense) back to '
+        + 'labels.npz.')
+    opts.add_argument('--dense', action='store_true',
+                      help="Convert labels.plr back to labels.npz.")
+    opts.add_argument('--batch', action='store_true',
+                      help="Treat target as a base directory, and convert "
+                      + "labels in every sub-directory.")
+    opts.add_argument('--remove', action='store_true',
+                      help="Remove original labels file after converting.")
+    opts.add_argument('target', help="Target directory (or base target "
+                      + "directory with --batch).")
+    args = opts.parse_args()
+    args.target = args.target.rstrip('/')
+
+    src = 'labels.plr' if args.dense else 'labels.npz'
+    if args.batch:
+        args.dlist = sorted(['/'.join(f.split('/')[:-1]) for f in
+                             glob(f'{args.target}/*/{src}')])
+    elif os.path.isfile(f'{args.target}/{src}'):
+        args.dlist = [args.target]
+    else:
+        sys.stderr.write(f'{args.target}/{src} does not exist.\n')
+        sys.exit(255)
+
+    return args
+
+
+if __name__ == "__main__":
+    ARGS = getargopts()
+    for tdir in tqdm(ARGS.dlist):
+        if ARGS.dense:
+            fnames = [f'{tdir}/labels.plr', f'{tdir}/labels.npz']
+            vol.todense(*fnames)
+        else:
+            fnames = [f'{tdir}/labels.npz', f'{tdir}/labels.plr']
+            vol.tosparse(*fnames)
+        if ARGS.remove:
+            os.remove(fnames[0])
+            if not ARGS.dense and os.path.isfile(vol.sidecar(fnames[0])):
+                os.remove(vol.sidecar(fnames[0]))
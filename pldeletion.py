@@ -19,8 +19,12 @@ def getargopts():
                       help='Type of the label: Options are (1) "deletion-onwards", (2) "deletion-upto", (3) "deletion-single" (default "deletion-onwards")',
                       default="deletion-onwards")
     opts.add_argument('--input', type=str, 
-                      help='Input file name (Default "clean.npz")',
+                      help='Input file name, .npz, .plr, or .stk (Default "clean.npz")',
                       default="clean.npz")
+    opts.add_argument('--prefetch', type=int, default=2048,
+                      help="Memory budget (MB) for reading labels of "
+                      + "adjacent sequences in advance (default 2048, "
+                      + "0 to disable)")
     opts.add_argument('basedir', help="Base (target) directory.")
     args = opts.parse_args()
 
@@ -33,12 +37,12 @@ def getargopts():
     
     if args.input[0] != '/':
         args.input = '/' + args.input
-    if args.input[-4:] != '.npz':
+    if args.input[-4:] not in ['.npz', '.plr', '.stk']:
         args.input = args.input + ".npz"
 
     print(args.basedir, "  ", args.input)
 
-    return args.basedir, args.port, args.name, args.type, args.input 
+    return args.basedir, args.port, args.name, args.type, args.input, args.prefetch
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Export crops and visualizations saved in stack files as image files."""
+
+import sys
+import os
+import argparse
+from glob import glob
+from tqdm import tqdm
+from skimage.io import imsave
+import plseg.utils as ut
+import plseg.volume as vol
+import plseg.frames as frm
+from plabel import labelsfile
+
+
+def getargopts():
+    """Parse command line arguments."""
+    opts = argparse.ArgumentParser(
+        description='Export aligned crops and visualizations saved by '
+        + 'plabel.py --stack as separate -crop and -seg image files.')
+    opts.add_argument('--batch', action='store_true',
+                      help="Treat target as a base directory, and export "
+                      + "every sub-directory with a crops.stk.")
+    opts.add_argument('--remove', action='store_true',
+                      help="Remove stack files after exporting.")
+    opts.add_argument('target', help="Target directory (or base target "
+                      + "directory with --batch).")
+    args = opts.parse_args()
+    args.target = args.target.rstrip('/')
+
+    if args.batch:
+        args.dlist = sorted(['/'.join(f.split('/')[:-1]) for f in
+                             glob(frm.stackname(args.target+'/*'))])
+    elif os.path.isfile(frm.stackname(args.target)):
+        args.dlist = [args.target]
+    else:
+        sys.stderr.write(f'{frm.stackname(args.target)} does not exist.\n')
+        sys.exit(255)
+
+    return args
+
+
+def doexport(tgtdir, progress=True):
+    """Write -crop and -seg images for all frames in stack files.
+
+    If visualizations were not saved, they are created from the crops and
+    labels.
+    """
+    crops = frm.Frames(tgtdir, 'crop')
+    segs, labels = None, None
+    if os.path.isfile(frm.stackname(tgtdir, 'seg')):
+        segs = frm.Frames(tgtdir, 'seg')
+    elif labelsfile(tgtdir) is not None:
+        labels = vol.load(labelsfile(tgtdir))
+
+    for i in tqdm(range(len(crops)), disable=not progress):
+        imgc = crops[i]
+        imsave(f'{tgtdir}/{crops.fname(i)}', imgc, check_contrast=False)
+        if segs is not None:
+            imsave(f'{tgtdir}/{crops.fname(i, "seg")}', segs[i],
+                   check_contrast=False)
+        elif labels is not None:
+            imsave(f'{tgtdir}/{crops.fname(i, "seg")}',
+                   ut.visualize(imgc, labels[:, :, i]), check_contrast=False)
+
+
+if __name__ == "__main__":
+    ARGS = getargopts()
+    for tdir in ARGS.dlist:
+        print(f'Exporting {tdir}')
+        doexport(tdir)
+        if ARGS.remove:
+            for kind in ['crop', 'seg']:
+                if os.path.isfile(frm.stackname(tdir, kind)):
+                    os.remove(frm.stackname(tdir, kind))
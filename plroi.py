@@ -12,10 +12,21 @@ def getargopts():
     opts.add_argument('--port', type=int,
                       help="Port to listen to (default 8888)",
                       default=8888)
+    opts.add_argument('--preview', type=int,
+                      help="Show images downscaled to this size (longest "
+                      + "side), or 0 for full size (default 1600)",
+                      default=1600)
+    opts.add_argument('--cache', help="Directory to cache previews in "
+                      + "(default: .previews in base target directory)",
+                      default=None)
+    opts.add_argument('--prewarm', action='store_true',
+                      help="Create previews of the first image shown for "
+                      + "every sequence in the background at start.")
     opts.add_argument('srcbase', help="Base source directory.")
     opts.add_argument('targetbase', help="Base target directory.")
     args = opts.parse_args()
-    return args.srcbase, args.targetbase, args.port
+    return (args.srcbase, args.targetbase, args.port, args.preview,
+            args.cache, args.prewarm)
 
 
 if __name__ == "__main__":
@@ -6,15 +6,21 @@ import io
 from glob import glob
 import flask
 import numpy as np
-from imageio import imwrite
-from . import utils as ut
+from .frames import Frames
+from . import volume as vol
+from . import edits as ed
+from . import overlay
 
 
 APP = flask.Flask("plseg-clean")
 APP.targetid = None
-APP.flist = []
+APP.crops = []
 APP.lbls = []
 APP.dlist = []
+APP.overlays = overlay.Cache()
+APP.prefetch = None
+# Label file formats that can be cleaned up
+LABELS = ('npz', 'plr', 'stk')
 
 
 # Commented out code to enable selection based on where plant appeared,
@@ -37,20 +43,21 @@ APP.dlist = []
 @APP.route("/", methods=["GET"])
 def index():
     """Return html file."""
-    return flask.send_file(APP.ldir+"/clean.html", cache_timeout=0)
+    return flask.send_file(APP.ldir+"/clean.html", max_age=0)
 
 
 @APP.route("/clean.js", methods=["GET"])
 def cleanjs():
     """Return javascript file."""
-    return flask.send_file(APP.ldir+"/clean.js", cache_timeout=0)
+    return flask.send_file(APP.ldir+"/clean.js", max_age=0)
 
 
 @APP.route("/img/<imid>", methods=["GET"])
 def getimg(imid):
     """Return base image of current sequence."""
     imid = int(imid.split(":")[1])
-    return flask.send_file(APP.flist[imid], cache_timeout=0)
+    fobj, mimetype = APP.crops.imgfile(imid)
+    return flask.send_file(fobj, mimetype=mimetype, max_age=0)
 
 
 @APP.route("/getlabel/<data>", methods=["GET"])
@@ -68,21 +75,13 @@ def getseg(data):
     """Return segmentation mask as PNG with alpha channel."""
     data = [int(f) for f in data.split(':')][1:]
     imid = data[0]
-    if len(data) > 1:
-        removed = data[1:]
+    removed = tuple(sorted(set(data[1:])))
 
-    img = np.ones((APP.lbls.shape[0], APP.lbls.shape[1], 4), np.float32)
-    img[:, :, -1] = 0.5
-    img[:, :, :3] = ut.CMAP[APP.lbls[:, :, imid] % ut.CMAP.shape[0], :]
-    img[APP.lbls[:, :, imid] == 0, :3] = 0
-    if len(data) > 1:
-        for j in removed:
-            img[APP.lbls[:, :, imid] == j, :] = 1.0
-
-    mem = io.BytesIO()
-    imwrite(mem, (img*255).astype(np.uint8), format="png")
-    mem.seek(0)
-    return flask.send_file(mem, mimetype="image/png", cache_timeout=0)
+    png = APP.overlays.get(
+        (APP.targetid, imid, removed),
+        lambda: overlay.render(APP.lbls[:, :, imid], removed))
+    return flask.send_file(io.BytesIO(png), mimetype="image/png",
+                           max_age=0)
 
 
 @APP.route("/save/<data>", methods=["GET"])
@@ -95,18 +94,12 @@ def save(data):
     fname = APP.basedir + '/' + APP.dlist[APP.targetid] + '/clean.npz'
 
     if len(removed) == 0:
-        idx = np.zeros((np.amax(APP.lbls) + 1,), APP.lbls.dtype)
-        _id = 1
-        for i in range(1, len(idx)):
-            if i not in removed:
-                idx[i] = _id
-                _id = _id + 1
-        lbls = idx[APP.lbls]
+        edits = ed.Edits(renumber=True, drop=removed)
     else:
-        lbls = APP.lbls
+        edits = ed.Edits()
 
-    npz = {'removed': np.asarray(removed, np.int16), 'labels': lbls}
-    np.savez_compressed(fname, **npz)
+    ed.savenpz(fname, APP.lbls, edits,
+               arrays={'removed': np.asarray(removed, np.int16)})
     return ' '
 
 
@@ -114,11 +107,17 @@ def save(data):
 def load(targetid):
     """Switch to different directory and return info."""
     APP.targetid = targetid
+    APP.overlays.clear()
     tdir = APP.basedir + '/' + APP.dlist[targetid]
-    APP.flist = sorted(glob(tdir+'/*-crop.*'))
-    APP.lbls = np.load(tdir+'/labels.npz')['labels']
+    APP.crops = Frames(tdir)
+    APP.lbls = vol.editable(vol.find(tdir, exts=LABELS))
+    if APP.prefetch is not None:
+        APP.prefetch.request([vol.find(APP.basedir+'/'+APP.dlist[_j],
+                                       exts=LABELS)
+                              for _j in [targetid+1, targetid-1]
+                              if 0 <= _j < len(APP.dlist)])
     # findfirst()
-    resp = {'numi': len(APP.flist)}
+    resp = {'numi': len(APP.crops)}
     if os.path.isfile(tdir+'/clean.npz'):
         resp['saved'] = True
         resp['removed'] = [int(f)
@@ -134,11 +133,13 @@ def getdlist():
     return flask.jsonify(APP.dlist)
 
 
-def main(basedir, port=8888):
-    """Run server"""
+def main(basedir, port=8888, prefetch=2048):
+    """Run server, prefetching up to prefetch MB of adjacent labels."""
     APP.ldir = "/".join(__file__.split('/')[:-1]) + '/jshtml'
     APP.basedir = basedir.rstrip("/")
-    APP.dlist = sorted([f.split('/')[-2]
-                        for f in glob(basedir+'/*/labels.npz')])
+    APP.dlist = sorted(set([f.split('/')[-2] for ext in LABELS
+                            for f in glob(basedir+'/*/labels.'+ext)]))
+    if prefetch > 0:
+        APP.prefetch = vol.Prefetcher(prefetch*2**20)
 
     APP.run(port=port)
@@ -3,18 +3,91 @@
 
 import numpy as np
 from scipy.signal import convolve2d as conv2
+from scipy.signal import fftconvolve as fftconv
 from skimage.color import rgb2lab
 
 
-def unary(img, opt):
-    """Get per-pixel likelihood of it being foreground."""
+# sRGB uint8 value to linear RGB, and linear RGB to X/Xn and Y/Yn (for the
+# D65 white point), matching the conversion in skimage.color.rgb2lab.
+_SRGB = np.arange(256, dtype=np.float64)/255
+_SRGB = np.float32(np.where(_SRGB > 0.04045, ((_SRGB+0.055)/1.055)**2.4,
+                            _SRGB/12.92))
+_RGB2XY = np.float32(np.transpose([[0.412453, 0.357580, 0.180423],
+                                   [0.212671, 0.715160, 0.072169]])
+                     / np.float64([[0.95047, 1.0]]))
+
+
+def achannel(img):
+    """Compute only the a* channel of Lab for a uint8 RGB image.
+
+    Works in float32 without the full Lab conversion, and agrees with
+    rgb2lab(img)[:, :, 1] to within 1.2e-4 for all 8-bit colors.
+    """
+    _xy = np.matmul(_SRGB[img], _RGB2XY)
+    _xy = np.where(_xy > 0.008856, np.cbrt(_xy),
+                   np.float32(7.787)*_xy + np.float32(16/116))
+    return np.float32(500)*(_xy[:, :, 0]-_xy[:, :, 1])
+
+
+def unarytol(opt):
+    """Largest difference between unary and unarylab for uint8 RGB images.
+
+    The likelihood changes by at most 1/(4*grsensitivity) per unit of a*, so
+    this scales the error of achannel, and adds float32 rounding.
+    """
+    return 1.2e-4/(4*abs(opt.grsensitivity)) + 1e-6
+
+
+def unarylab(img, opt):
+    """Reference version of unary using full Lab conversion."""
 
     aimg = (rgb2lab(img)[:, :, 1]).astype(np.float32)
-    aimg = np.exp((-aimg-opt.grthresh)/opt.grsensitivity)
+    # Capped so that exp does not overflow (giving 1.0 after division)
+    aimg = np.exp(np.minimum((-aimg-opt.grthresh)/opt.grsensitivity, 80))
     aimg = aimg / (1+aimg)
     return aimg
 
 
+def unary(img, opt):
+    """Get per-pixel likelihood of it being foreground.
+
+    Uses the fast a* computation for uint8 RGB images, which gives values
+    within unarytol(opt) of unarylab, and falls back to unarylab for others.
+    """
+
+    if img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 3:
+        return unarylab(img, opt)
+    aimg = achannel(img)
+    aimg = np.exp(np.minimum((-aimg-opt.grthresh)
+                             / np.float32(opt.grsensitivity), np.float32(80)))
+    aimg /= 1+aimg
+    return aimg
+
+
+def _conv1(img, kern, axis):
+    """1D 'valid' convolution of img along axis."""
+    nout = img.shape[axis]-len(kern)+1
+    out = None
+    for k, wt in enumerate(kern[::-1]):
+        sl = [slice(None)]*img.ndim
+        sl[axis] = slice(k, k+nout)
+        if out is None:
+            out = wt*img[tuple(sl)]
+        else:
+            out += wt*img[tuple(sl)]
+    return out
+
+
+def _pwmethod(shape, opt):
+    """Choose how to compute derivatives based on filter and image size."""
+    if opt.fmethod != 'auto':
+        return opt.fmethod
+    # Separable filtering costs O(fsz) per pixel, FFT O(log(#pixels)).
+    if opt.fsz > np.log2(shape[0]*shape[1]):
+        return 'fft'
+    return 'separable'
+
+
 def pairwise(img, opt):
     """Get edge weightings for LR-UD-DR-DL pairs"""
 
@@ -22,21 +95,39 @@ def pairwise(img, opt):
     img = np.pad(img, [[opt.fsz//2-1, opt.fsz//2],
                        [opt.fsz//2-1, opt.fsz//2]],
                  'symmetric')
-    _x = np.arange(opt.fsz, dtype=np.float32) - (opt.fsz-1)/2
-    _x, _y = np.meshgrid(_x, _x)
+    _v = np.arange(opt.fsz, dtype=np.float32) - (opt.fsz-1)/2
+    _x, _y = np.meshgrid(_v, _v)
 
-    gfx = _x*np.exp(-(_x**2+_y**2)/2/opt.fsgm)
-    gfy = np.transpose(gfx)
+    # gfx is separable into a Gaussian along y and derivative along x
+    method = _pwmethod(img.shape, opt)
+    if method == 'separable':
+        gss = np.exp(-_v**2/2/opt.fsgm)
+        imx = _conv1(_conv1(img, gss, 0), _v*gss, 1)
+        imy = _conv1(_conv1(img, gss, 1), _v*gss, 0)
+    else:
+        gfx = _x*np.exp(-(_x**2+_y**2)/2/opt.fsgm)
+        gfy = np.transpose(gfx)
+        if method == 'fft':
+            imx = fftconv(img, gfx, 'valid').astype(np.float32)
+            imy = fftconv(img, gfy, 'valid').astype(np.float32)
+        elif method == 'direct':
+            imx = conv2(img, gfx, 'valid')
+            imy = conv2(img, gfy, 'valid')
+        else:
+            raise ValueError(f'Unknown derivative filtering method {method}.')
 
-    imx = conv2(img, gfx, 'valid')
-    imy = conv2(img, gfy, 'valid')
-    imdr, imdl = (imx+imy)**2, (imx-imy)**2
-    imx, imy = imx**2, imy**2
+    # Compute all four exp maps in place in one array
+    out = np.empty((4,)+imx.shape, np.float32)
+    np.add(imx, imy, out=out[2])
+    np.subtract(imx, imy, out=out[3])
+    np.square(imx, out=out[0])
+    np.square(imy, out=out[1])
+    np.square(out[2:], out=out[2:])
 
-    means = [np.mean(imx), np.mean(imy), np.mean(imdr), np.mean(imdl)]
-    imx = np.exp(-imx / means[0] / opt.fsensitivity)
-    imy = np.exp(-imy / means[1] / opt.fsensitivity)
-    imdr = 0.5*np.exp(-imdr / means[2] / opt.fsensitivity)
-    imdl = 0.5*np.exp(-imdl / means[3] / opt.fsensitivity)
+    for k in range(4):
+        np.divide(out[k], -np.mean(out[k]), out=out[k])
+    np.divide(out, np.float32(opt.fsensitivity), out=out)
+    np.exp(out, out=out)
+    out[2:] *= 0.5
 
-    return imy[:-1, :], imx[:, :-1], imdr[:-1, :-1], imdl[:-1, 1:]
+    return out[1, :-1, :], out[0, :, :-1], out[2, :-1, :-1], out[3, :-1, 1:]
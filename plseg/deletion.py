@@ -9,18 +9,22 @@ import io
 from glob import glob
 import flask
 import numpy as np
-from imageio import imwrite
-from . import utils as ut
+from .frames import Frames
+from . import volume as vol
+from . import edits as ed
+from . import overlay
 
 
 APP = flask.Flask("plseg-deletion")#APP = flask.Flask("plseg-clean")
 APP.targetid = None
-APP.flist = []
+APP.crops = []
 APP.lbls = []
 APP.dlist = []
 APP.tag_name = ""
 APP.tag_type = ""
 APP.input_name = ""
+APP.overlays = overlay.Cache()
+APP.prefetch = None
 
 
 # Commented out code to enable selection based on where plant appeared,
@@ -43,20 +47,21 @@ APP.input_name = ""
 @APP.route("/", methods=["GET"])
 def index():
     """Return html file."""
-    return flask.send_file(APP.ldir+"/deletion.html", cache_timeout=0)
+    return flask.send_file(APP.ldir+"/deletion.html", max_age=0)
 
 
 @APP.route("/deletion.js", methods=["GET"])
 def planttagjs():
     """Return javascript file."""
-    return flask.send_file(APP.ldir+"/deletion.js", cache_timeout=0)
+    return flask.send_file(APP.ldir+"/deletion.js", max_age=0)
 
 
 @APP.route("/img/<imid>", methods=["GET"])
 def getimg(imid):
     """Return base image of current sequence."""
     imid = int(imid.split(":")[1])
-    return flask.send_file(APP.flist[imid], cache_timeout=0)
+    fobj, mimetype = APP.crops.imgfile(imid)
+    return flask.send_file(fobj, mimetype=mimetype, max_age=0)
 
 
 @APP.route("/getlabel/<data>", methods=["GET"])
@@ -82,25 +87,24 @@ def getseg(data):
         removed = data[1:]
         frames = [int(f) for f in frames.split(':')]
 
-    img = np.ones((APP.lbls.shape[0], APP.lbls.shape[1], 4), np.float32)
-    img[:, :, -1] = 0.5
-    img[:, :, :3] = ut.CMAP[APP.lbls[:, :, imid] % ut.CMAP.shape[0], :]
-    img[APP.lbls[:, :, imid] == 0, :3] = 0
+    shown = set()
     if len(data) > 1:
         for j in range(len(removed)):
             rem = removed[j]
             rem_frame = frames[j]
             if APP.tag_type == "deletion-onwards" and imid >= rem_frame:
-                img[APP.lbls[:, :, imid] == rem, :] = 1.0
+                shown.add(rem)
             elif APP.tag_type == "deletion-upto" and imid <= rem_frame:
-                img[APP.lbls[:, :, imid] == rem, :] = 1.0
+                shown.add(rem)
             elif APP.tag_type == "deletion-single" and imid == rem_frame:
-                img[APP.lbls[:, :, imid] == rem, :] = 1.0
+                shown.add(rem)
+    shown = tuple(sorted(shown))
 
-    mem = io.BytesIO()
-    imwrite(mem, (img*255).astype(np.uint8), format="png")
-    mem.seek(0)
-    return flask.send_file(mem, mimetype="image/png", cache_timeout=0)
+    png = APP.overlays.get(
+        (APP.targetid, imid, shown),
+        lambda: overlay.render(APP.lbls[:, :, imid], shown))
+    return flask.send_file(io.BytesIO(png), mimetype="image/png",
+                           max_age=0)
 
 
 @APP.route("/save/<data>", methods=["GET"])
@@ -118,35 +122,32 @@ def save(data):
     fname = APP.basedir + '/' + APP.dlist[APP.targetid] + '/' + APP.tag_name + '.npz'
 
     if len(removed) == 0:  # Before: if len(removed) == 0
-        idx = np.zeros((np.amax(APP.lbls) + 1,), APP.lbls.dtype)
-        _id = 1
-        for i in range(1, len(idx)):
-            if i not in removed:
-                idx[i] = _id
-                _id = _id + 1
-        lbls = idx[APP.lbls]
+        edits = ed.Edits(renumber=True, drop=removed)
     else:
-        lbls = APP.lbls
+        edits = ed.Edits()
 
     for j in range(len(removed)):
         rem = removed[j]
         frame = frames[j]
         # Remove that label from the frame onwards:
         if APP.tag_type == "deletion-onwards":
-            lbls[:,:,frame:][lbls[:,:,frame:] == rem] = 0
+            edits.onwards(rem, frame)
         elif APP.tag_type == "deletion-upto":
-            lbls[:,:,:frame][lbls[:,:,:frame] == rem] = 0
+            edits.upto(rem, frame)
         elif APP.tag_type == "deletion-single":
-            lbls[:,:,frame][lbls[:,:,frame] == rem] = 0
-    
-    # 
-    tag = [-1]*lbls.max()
-    for i in range(len(removed)):
-        tag[removed[i]] = frames[i]
-
-    npz = {'removed': np.asarray(removed, np.int16), 'labels': lbls, "frames": np.asarray(frames, np.int16), \
-        APP.tag_name: tag}
-    np.savez_compressed(fname, **npz)
+            edits.single(rem, frame)
+
+    def _arrays(edits):
+        tag = [-1]*edits.lmax
+        for i in range(len(removed)):
+            tag[removed[i]] = frames[i]
+        return {'removed': np.asarray(removed, np.int16),
+                "frames": np.asarray(frames, np.int16), APP.tag_name: tag}
+
+    # As before, edits are also made to APP.lbls when labels are removed
+    APP.overlays.clear()
+    ed.savenpz(fname, APP.lbls, edits, inplace=len(removed) > 0,
+               arrays=_arrays)
     return ' '
 
 
@@ -154,15 +155,18 @@ def save(data):
 def load(targetid):
     """Switch to different directory and return info."""
     APP.targetid = targetid
+    APP.overlays.clear()
     tdir = APP.basedir + '/' + APP.dlist[targetid]
-    APP.flist = sorted(glob(tdir+'/*-crop.*'))
-
-    load_file = np.load(tdir+APP.input_name)
+    APP.crops = Frames(tdir)
 
     #APP.lbls = np.load(tdir+'/labels.npz')['labels']
-    APP.lbls = load_file['labels']
+    APP.lbls = vol.editable(tdir+APP.input_name)
+    if APP.prefetch is not None:
+        APP.prefetch.request([APP.basedir+'/'+APP.dlist[_j]+APP.input_name
+                              for _j in [targetid+1, targetid-1]
+                              if 0 <= _j < len(APP.dlist)])
     # findfirst()
-    resp = {'numi': len(APP.flist)}
+    resp = {'numi': len(APP.crops)}
     # if os.path.isfile(tdir+'/planttag.npz'):
     if os.path.isfile(tdir + "/" + APP.tag_name + '.npz'):
         #load_planttag = np.load(tdir+'/planttag.npz')
@@ -194,8 +198,8 @@ def getdlist():
     return flask.jsonify(resp)#flask.jsonify(APP.dlist)
 
 
-def main(basedir, port=8888, name="bloom-time", ttype="deletion-onwards", input_name="/clean.npz"):
-    """Run server"""
+def main(basedir, port=8888, name="bloom-time", ttype="deletion-onwards", input_name="/clean.npz", prefetch=2048):
+    """Run server, prefetching up to prefetch MB of adjacent labels."""
     APP.ldir = "/".join(__file__.split('/')[:-1]) + '/jshtml'
     APP.basedir = basedir.rstrip("/")
     APP.dlist = sorted([f.split('/')[-2]
@@ -204,6 +208,8 @@ def main(basedir, port=8888, name="bloom-time", ttype="deletion-onwards", input_
     APP.tag_name = name
     APP.tag_type = ttype
     APP.input_name = input_name
+    if prefetch > 0:
+        APP.prefetch = vol.Prefetcher(prefetch*2**20)
 
     APP.run(port=port)
     
@@ -0,0 +1,118 @@
+"""Apply edits to label volumes one frame at a time, with lookup tables.
+
+Edits (deleting labels from some range of frames, and renumbering the
+remaining labels consecutively) are compiled into one lookup table per
+frame, so that editing a frame is a single indexing pass over it however
+many edits there are, and volumes never have to be copied whole.
+"""
+
+import os
+import numpy as np
+from . import volume as vol
+
+
+class Edits:
+    """A set of edits to an H x W x N label volume.
+
+    If renumber is True, labels (other than those in drop, which are
+    removed everywhere) are renumbered from 1 in order. Deletions always
+    refer to labels before renumbering.
+    """
+
+    def __init__(self, renumber=False, drop=()):
+        self.renumber = renumber
+        self.drop = np.asarray(sorted(set(drop)), np.int64)
+        self.deletions = []
+        self.lmax = None
+
+    def delete(self, label, frames=slice(None)):
+        """Delete label from frames (a slice, or a single frame index)."""
+        self.deletions.append((label, frames))
+
+    def onwards(self, label, frame):
+        """Delete label from frame onwards."""
+        self.delete(label, slice(frame, None))
+
+    def upto(self, label, frame):
+        """Delete label from frames before frame."""
+        self.delete(label, slice(None, frame))
+
+    def single(self, label, frame):
+        """Delete label from only the one frame."""
+        self.delete(label, frame)
+
+    def compile(self, nframes):
+        """Arrays of deleted labels and the [start, stop) of their frames."""
+        labels, starts, stops = [], [], []
+        for label, frames in self.deletions:
+            if isinstance(frames, slice):
+                start, stop, step = frames.indices(nframes)
+                if step != 1:
+                    raise ValueError('Deletions must be from a contiguous '
+                                     + 'range of frames.')
+            else:
+                if not -nframes <= frames < nframes:
+                    raise IndexError(f'Frame {frames} out of range for '
+                                     + f'{nframes} frames.')
+                start = frames % nframes
+                stop = start + 1
+            labels.append(label)
+            starts.append(start)
+            stops.append(stop)
+        return (np.asarray(labels, np.int64), np.asarray(starts, np.int64),
+                np.asarray(stops, np.int64))
+
+    def table(self, size, dtype, deleted):
+        """Lookup table for labels 0 to size-1, with deleted labels."""
+        if self.renumber:
+            keep = np.ones((size,), bool)
+            keep[0] = False
+            keep[self.drop[(self.drop >= 0) & (self.drop < size)]] = False
+            lut = np.where(keep, np.cumsum(keep), 0).astype(dtype)
+        else:
+            lut = np.arange(size, dtype=dtype)
+        lut[deleted[(deleted >= 0) & (deleted < size)]] = 0
+        return lut
+
+    def apply(self, labels, inplace=False):
+        """Yield edited frames of a volume (array, memmap, or LabelStore).
+
+        If inplace is True, edited frames are also written back to labels.
+        After all frames are yielded, lmax is set to the largest label in
+        the edited volume.
+        """
+        nframes = labels.shape[-1]
+        dlabels, starts, stops = self.compile(nframes)
+        self.lmax = 0
+        for _t in range(nframes):
+            frame = np.asarray(labels[:, :, _t])
+            deleted = dlabels[(starts <= _t) & (_t < stops)]
+            if self.renumber or self.drop.size or deleted.size:
+                size = int(np.amax(frame)) + 1 if frame.size else 1
+                frame = self.table(size, frame.dtype, deleted)[frame]
+                if inplace:
+                    labels[:, :, _t] = frame
+            if frame.size:
+                self.lmax = max(self.lmax, int(np.amax(frame)))
+            yield frame
+
+
+def savenpz(fname, labels, edits, inplace=False, arrays=None):
+    """Save edited labels (and other arrays) to an npz file.
+
+    Labels are edited and written one frame at a time, with the same dtype
+    as the original volume. arrays is a dictionary of other arrays to save,
+    or a function that is called with edits (after they have been applied)
+    to get one. fname is only replaced once everything has been written.
+    """
+    tmpname = f'{fname}.{os.getpid()}.tmp'
+    try:
+        vol.savenpz(tmpname, edits.apply(labels, inplace), labels.shape,
+                    labels.dtype)
+        if callable(arrays):
+            arrays = arrays(edits)
+        vol.addnpz(tmpname, **(arrays or {}))
+        os.replace(tmpname, fname)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
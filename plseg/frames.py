@@ -0,0 +1,67 @@
+"""Read per-frame images of a sequence, from image files or a stack file.
+
+plabel.py saves the aligned crops (and visualizations of segmentations)
+of each sequence either as separate {name}-crop.{ext} (and -seg) image
+files, or as frames of a single crops.stk (and segs.stk) stack file, with
+the original {name} and {ext} of each frame stored as its metadata.
+"""
+
+import io
+import os
+from imageio import imwrite
+from skimage.io import imread
+from .stack import Stack
+from . import seqindex
+
+
+def stackname(tdir, kind='crop'):
+    """Stack file name for kind ('crop' or 'seg') of images."""
+    return f'{tdir}/{kind}s.stk'
+
+
+class Frames:
+    """Images of one kind ('crop', 'seg', etc.) for frames of a sequence.
+
+    Reads from the stack file for that kind if it exists, and otherwise
+    from the {name}-{kind}.{ext} image files in tdir.
+    """
+
+    def __init__(self, tdir, kind='crop'):
+        self.kind = kind
+        if os.path.isfile(stackname(tdir, kind)):
+            self.stack = Stack(stackname(tdir, kind))
+            self.files = None
+            self.names = [(m['name'], m['ext']) for m in self.stack.metas]
+        else:
+            self.stack = None
+            self.files = seqindex.matching(tdir, f'*-{kind}.*')
+            self.names = []
+            for fname in self.files:
+                name, ext = fname.split('/')[-1].rsplit('.', 1)
+                self.names.append((name[:-len(kind)-1], ext))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        if self.stack is not None:
+            return self.stack[idx]
+        return imread(self.files[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def fname(self, idx, kind=None):
+        """File name (without directory) for frame idx of kind."""
+        name, ext = self.names[idx]
+        return f'{name}-{kind or self.kind}.{ext}'
+
+    def imgfile(self, idx):
+        """Image file, or PNG in memory, and mimetype, for frame idx."""
+        if self.stack is None:
+            return self.files[idx], None
+        mem = io.BytesIO()
+        imwrite(mem, self.stack[idx], format='png')
+        mem.seek(0)
+        return mem, 'image/png'
@@ -5,8 +5,10 @@ from dataclasses import dataclass
 import numpy as np
 import scipy.ndimage as ndi
 from skimage.morphology import convex_hull_image as chi
-import gco
 from .costs import unary, pairwise
+from .tiled import tiledcut, bandcut, cropewts
+from .solvers import cut
+from . import trace
 
 
 @dataclass
@@ -17,30 +19,77 @@ class Options:
     fsz: int = 8  # Derivative filter size
     fsgm: int = 2  # Sigma^2 of derivative filter Gaussian
     fsensitivity: int = 4  # How fast derivative magnitude saturates
+    fmethod: str = 'auto'  # Derivative filtering: separable / fft / direct
     uwt: int = 10000  # Relative weight of unary cost
     ewt: int = 5000  # Relative weight of spatial edge costs
     zwt: int = 2500  # Relative weight of edge to same pixel in previous frame
     ccnbd: int = 10  # Two pixels in same connected component if < ccnbd apart
     joinit: int = 50  # Number of join iterations for disconnected plant parts
     joininc: int = 100  # Amount to increment score by
+    joinsearch: str = 'linear'  # Search for join score: linear / bisect
+    tilesize: int = 0  # Solve binary cut in tiles of this size if > 0
+    tileoverlap: int = 16  # Overlap between tiles, and half-width of seams
+    tilethreads: int = 0  # Number of threads for tiles (0 for all cores)
+    solver: str = 'gco'  # Graph cut solver: gco / maxflow (for binary cuts)
+    solveriter: int = -1  # Max. gco iterations (-1 to run till convergence)
+    solveralgo: str = 'expansion'  # gco algorithm: expansion / swap
+    c2flevels: int = 0  # Solve binary cut at 1/2^c2flevels scale first if > 0
+    c2fband: int = 4  # Half-width of boundary band re-solved at full scale
 
 
 _PLOPT = Options()
 
 
+def _joinsearch(connects, joinit, method):
+    """Find smallest k in [1, joinit] where connects(k), or None.
+
+    The linear search tries every k in order. The bisection search assumes
+    that connects is monotonic in k, and gallops (k = 1, 2, 4, ...) to find
+    an upper bound before bisecting, using O(log(joinit)) calls. Either way,
+    the k returned is that of the last call to connects that was true.
+    """
+
+    if method == 'linear':
+        for k in range(1, joinit+1):
+            if connects(k):
+                return k
+        return None
+    if method != 'bisect':
+        raise ValueError(f'Unknown join search method {method}.')
+
+    lo, k = 0, 1
+    while not connects(k):
+        if k == joinit:
+            return None
+        lo, k = k, min(2*k, joinit)
+    while k - lo > 1:
+        mid = (lo + k) // 2
+        if connects(mid):
+            k = mid
+        else:
+            lo = mid
+    return k
+
+
 def joincc(lmap, prev, ucost0, ewts, opt):
     """Create joins to ensure each plant is one connected component."""
 
     pwcost = 1-np.eye(2, dtype=np.int32)
-    for lbl in range(1, np.amax(lmap)+1):
-        ncc = ndi.label(lmap == lbl)[1]
+    # Labels only ever lose pixels to joins of other labels, so bounding
+    # boxes found at the start contain each label's pixels at its turn.
+    for lbl, obj in enumerate(ndi.find_objects(lmap), 1):
+        if obj is None:
+            continue
+        lmobj = lmap[obj] == lbl
+        ncc = ndi.label(lmobj)[1]
         if ncc <= 1:
             continue
+        trace.count('joins')
 
         # Crop out portions just including that component
-        _y, _x = np.where(lmap == lbl)
-        _y1, _y2 = np.amin(_y), np.amax(_y)+1
-        _x1, _x2 = np.amin(_x), np.amax(_x)+1
+        _y, _x = np.where(lmobj)
+        _y1, _y2 = obj[0].start+np.amin(_y), obj[0].start+np.amax(_y)+1
+        _x1, _x2 = obj[1].start+np.amin(_x), obj[1].start+np.amax(_x)+1
 
         lmxy = lmap[_y1:_y2, _x1:_x2]
         uc0 = (ucost0[_y1:_y2, _x1:_x2]).copy()
@@ -52,39 +101,42 @@ def joincc(lmap, prev, ucost0, ewts, opt):
         ucost = np.zeros([lmxy.shape[0], lmxy.shape[1], 2], np.int32)
         ucost[:, :, 0] = -opt.uwt
         ucost[lmxy == lbl, 0] = opt.uwt
-        ucost[chull, 0] = uc0[chull]
-
-        ew0 = [ewts[0][_y1:(_y2-1), _x1:_x2],
-               ewts[1][_y1:_y2, _x1:(_x2-1)],
-               ewts[2][_y1:(_y2-1), _x1:(_x2-1)],
-               ewts[3][_y1:(_y2-1), _x1:(_x2-1)]]
-
-        joined = False
-        for _ in range(opt.joinit):
-            # Do a graph cut after biasing the background
-            ucost[chull, 0] = ucost[chull, 0] + opt.joininc
-            lmxy2 = gco.cut_grid_graph(ucost, pwcost, *ew0).reshape(lmxy.shape)
-
-            if ndi.label(lmxy2 == 1)[1] == 1:
-                # Now, see if we can remove some of the added components
-                newcomps, nnc = ndi.label(np.logical_and(lmxy2 == 1,
-                                                         lmxy == 0))
-                if nnc > 1:
-                    scores = np.bincount(newcomps.flatten(), uc0.flatten())
-                    cidx = np.argsort(scores[1:]) + 1
-                    for ncidx in cidx:
-                        lmxy2b = lmxy2.copy()
-                        lmxy2b[newcomps == ncidx] = 0
-                        if ndi.label(lmxy2b)[1] == 1:
-                            lmxy2 = lmxy2b
-
-                # Patch things back in
-                lmxy[lmxy2 == 1] = lbl
-                lmap[_y1:_y2, _x1:_x2] = lmxy
-                joined = True
-                break
-
-        if not joined:
+
+        ew0 = cropewts(ewts, _y1, _y2, _x1, _x2)
+
+        # _joinsearch returns the k of the last connecting call, so only
+        # that call's cut needs to be kept.
+        accepted = [None]
+
+        def _connects(k):
+            # Do a graph cut after biasing the background k times
+            trace.count('join_iters')
+            ucost[chull, 0] = uc0[chull] + k*opt.joininc
+            lcut = cut(ucost, pwcost, ew0, opt, 'join').reshape(lmxy.shape)
+            if ndi.label(lcut == 1)[1] != 1:
+                return False
+            accepted[0] = lcut
+            return True
+
+        k = _joinsearch(_connects, opt.joinit, opt.joinsearch)
+        if k is not None:
+            lmxy2 = accepted[0]
+            # Now, see if we can remove some of the added components
+            newcomps, nnc = ndi.label(np.logical_and(lmxy2 == 1,
+                                                     lmxy == 0))
+            if nnc > 1:
+                scores = np.bincount(newcomps.flatten(), uc0.flatten())
+                cidx = np.argsort(scores[1:]) + 1
+                for ncidx in cidx:
+                    lmxy2b = lmxy2.copy()
+                    lmxy2b[newcomps == ncidx] = 0
+                    if ndi.label(lmxy2b)[1] == 1:
+                        lmxy2 = lmxy2b
+
+            # Patch things back in
+            lmxy[lmxy2 == 1] = lbl
+            lmap[_y1:_y2, _x1:_x2] = lmxy
+        else:
             ccxy = ndi.label(lmxy == lbl)[0]
             ccount = np.bincount(ccxy.flatten())
             ccsort = np.argsort(-ccount[1:])
@@ -95,21 +147,24 @@ def joincc(lmap, prev, ucost0, ewts, opt):
     return lmap
 
 
-def splitlabel(lmap, mask, prev, slbls, ucost0, ewts, opt):
-    """Split a new connected component that overlaps multiple components"""
+def splitlabel(lmap, obj, mask, prev, slbls, ucost0, ewts, opt):
+    """Split a new connected component that overlaps multiple components.
 
-    _ys, _xs = np.where(mask)
-    _y1, _y2, _x1, _x2 = np.amin(_ys), np.amax(_ys), np.amin(_xs), np.amax(_xs)
+    The component is given by a boolean mask within the bounding box obj
+    (a pair of slices, as returned by ndi.find_objects).
+    """
 
-    prev = prev[_y1:(_y2+1), _x1:(_x2+1)]
-    ucost0 = ucost0[_y1:(_y2+1), _x1:(_x2+1)]
+    _y1, _y2, _x1, _x2 = obj[0].start, obj[0].stop, obj[1].start, obj[1].stop
+
+    prev = prev[obj]
+    ucost0 = ucost0[obj]
     ucost = np.zeros(np.shape(ucost0) + (len(slbls)+1,), np.int32)
     ucost[:, :, 0] = ucost0
 
-    ewts = [ewts[0][_y1:_y2, _x1:(_x2+1)],
-            ewts[1][_y1:(_y2+1), _x1:_x2],
-            ewts[2][_y1:_y2, _x1:_x2],
-            ewts[3][_y1:_y2, _x1:_x2]]
+    ewts = [ewts[0][_y1:(_y2-1), _x1:_x2],
+            ewts[1][_y1:_y2, _x1:(_x2-1)],
+            ewts[2][_y1:(_y2-1), _x1:(_x2-1)],
+            ewts[3][_y1:(_y2-1), _x1:(_x2-1)]]
 
     ucost[prev > 0, :] = ucost[prev > 0, :] + opt.zwt
     for i, lbl in enumerate(slbls):
@@ -117,11 +172,10 @@ def splitlabel(lmap, mask, prev, slbls, ucost0, ewts, opt):
 
     pwcost = 1 - np.eye(len(slbls)+1, dtype=np.int32)
 
-    mcut0 = gco.cut_grid_graph(ucost, pwcost, *ewts).reshape(ucost0.shape)
-    mcut = np.zeros_like(lmap)
-    mcut[_y1:(_y2+1), _x1:(_x2+1)] = mcut0
+    mcut = cut(ucost, pwcost, ewts, opt, 'split').reshape(ucost0.shape)
+    lmobj = lmap[obj]
     for i, lbl in enumerate(slbls):
-        lmap[np.logical_and(mask, mcut == (i+1))] = lbl
+        lmobj[np.logical_and(mask, mcut == (i+1))] = lbl
 
 
 def separateconnect(binary, prev, ucost0, ewts, opt):
@@ -130,93 +184,191 @@ def separateconnect(binary, prev, ucost0, ewts, opt):
     ccs, nfound = ndi.label(ndi.binary_dilation(binary,
                                                 np.ones((2*opt.ccnbd+1,)*2)))
     ccs[binary == 0] = 0
+    ccount = np.bincount(ccs.flatten(), minlength=nfound+1)
+    trace.count('components', nfound)
     if prev is None:
-        lbl2 = 1
-        for lbl in range(1, nfound+1):
-            if len(np.where(ccs == lbl)[0]) < opt.ccnbd:
-                ccs[ccs == lbl] = 0
-            else:
-                ccs[ccs == lbl] = lbl2
-                lbl2 = lbl2 + 1
+        keep = ccount >= opt.ccnbd
+        keep[0] = False
+        lut = np.zeros((nfound+1,), ccs.dtype)
+        lut[keep] = np.arange(1, np.sum(keep)+1)
+        ccs = lut[ccs]
         if opt.joinit > 0:
-            ccs = joincc(ccs, prev, ucost0, ewts, opt)
+            with trace.stage('join'):
+                ccs = joincc(ccs, prev, ucost0, ewts, opt)
         return ccs
 
-    nexist, nnew = np.amax(prev), 0
+    nexist, nnew = int(np.amax(prev)), 0
     newmeans = []  # Store mean pos of new labels to match to missing from prev
 
-    lmap = np.zeros_like(ccs)
+    # Table of distinct (component, previous label) pairs that overlap, and
+    # sums of pixel co-ordinates to compute means of components & labels.
+    both = np.logical_and(ccs > 0, prev > 0)
+    pairs = np.unique(ccs[both].astype(np.int64)*(nexist+1) + prev[both])
+    pccs, plbls = pairs // (nexist+1), pairs % (nexist+1)
+    _y, _x = np.indices(ccs.shape, dtype=np.float64)
+    csums = [np.bincount(ccs.flatten(), _y.flatten(), nfound+1),
+             np.bincount(ccs.flatten(), _x.flatten(), nfound+1)]
+
+    lut = np.zeros((nfound+1,), ccs.dtype)
+    splits = []
     for lbl in range(1, nfound+1):
-        olbls = np.unique(prev[np.logical_and(prev > 0, ccs == lbl)])
+        olbls = plbls[np.searchsorted(pccs, lbl):
+                      np.searchsorted(pccs, lbl, 'right')]
         if len(olbls) == 0:
-            if len(np.where(ccs == lbl)[0]) < opt.ccnbd:
+            if ccount[lbl] < opt.ccnbd:
                 continue
             nnew = nnew+1
-            lmap[ccs == lbl] = -nnew
-            _lpos = np.where(ccs == lbl)
-            newmeans.append([np.mean(np.float64(_lpos[0])),
-                             np.mean(np.float64(_lpos[1]))])
-
+            lut[lbl] = -nnew
+            newmeans.append([csums[0][lbl]/ccount[lbl],
+                             csums[1][lbl]/ccount[lbl]])
         elif len(olbls) == 1:
-            lmap[ccs == lbl] = olbls[0]
+            lut[lbl] = olbls[0]
         else:
-            splitlabel(lmap, ccs == lbl, prev, olbls, ucost0, ewts, opt)
-
-    # Map missing old to new found labels
+            splits.append((lbl, olbls))
+
+    lmap = lut[ccs]
+    trace.count('splits', len(splits))
+    if len(splits) > 0:
+        objs = ndi.find_objects(ccs)
+        for lbl, olbls in splits:
+            with trace.stage('split'):
+                splitlabel(lmap, objs[lbl-1], ccs[objs[lbl-1]] == lbl, prev,
+                           olbls, ucost0, ewts, opt)
+
+    # Map missing old to new found labels. Only pixels of new labels, or of
+    # missing labels with nothing in the same place now, change in this
+    # loop, so how much of each old label is covered can be computed once.
     newmeans = np.asarray(newmeans, np.float64)
     missing = np.bincount(np.maximum(0, lmap.flatten()), minlength=(nexist+1))
     missing = list(np.where(missing[1:] == 0)[0] + 1)
+    pcount = np.bincount(prev.flatten(), minlength=nexist+1)
+    pcovered = np.bincount(prev.flatten(), (lmap != 0).flatten(), nexist+1)
+    psums = [np.bincount(prev.flatten(), _y.flatten(), nexist+1),
+             np.bincount(prev.flatten(), _x.flatten(), nexist+1)]
+
+    fill = np.zeros((nexist+1,), np.bool_)
+    nlut = np.zeros((len(newmeans)+1,), lmap.dtype)
     for mlbl in missing:
         if nnew == 0:
-            if np.all(lmap[prev == mlbl] == 0):
-                lmap[prev == mlbl] = mlbl
+            if pcovered[mlbl] == 0:
+                fill[mlbl] = True
             continue
 
-        _lpos = np.where(prev == mlbl)
-        if len(_lpos[0]) == 0:
+        if pcount[mlbl] == 0:
             continue
-        mlmean = np.asarray([np.mean(np.float64(_lpos[0])),
-                             np.mean(np.float64(_lpos[1]))], np.float64)
+        mlmean = np.asarray([psums[0][mlbl]/pcount[mlbl],
+                             psums[1][mlbl]/pcount[mlbl]], np.float64)
         dists = np.sum(np.square(mlmean-newmeans), -1)
         if np.nanmin(dists) < np.square(opt.ccnbd*8):
             idx = np.nanargmin(dists)
-            lmap[lmap == -(idx+1)] = mlbl
-            newmeans[idx, :] = np.NAN
+            nlut[idx+1] = mlbl
+            newmeans[idx, :] = np.nan
             nnew = nnew - 1
         else:  # Too far
-            if np.all(lmap[prev == mlbl] == 0):
-                lmap[prev == mlbl] = mlbl
+            if pcovered[mlbl] == 0:
+                fill[mlbl] = True
+
+    if np.any(fill):
+        lmap = np.where(fill[prev], prev, lmap)
 
     # Create new labels out of any left
-    idx = np.where(np.bincount(
-        np.maximum(0, -lmap.flatten()))[1:] >= opt.ccnbd)[0] + 1
-    for _i in idx:
-        nexist = nexist+1
-        lmap[lmap == (-_i)] = nexist
+    for _i in range(1, len(nlut)):
+        if nlut[_i] == 0:
+            nexist = nexist+1
+            nlut[_i] = nexist
+    neg = lmap < 0
+    lmap[neg] = nlut[-lmap[neg]]
 
     if opt.joinit > 0:
-        lmap = joincc(lmap, prev, ucost0, ewts, opt)
+        with trace.stage('join'):
+            lmap = joincc(lmap, prev, ucost0, ewts, opt)
 
     return lmap
 
 
-def label(img, prev, opt=_PLOPT):
-    """Label all plants in an image, using previous labels as guide."""
+def coarsecut(img, prev, opt):
+    """Binary segmentation at 1/2^c2flevels scale, upsampled to full size.
 
-    # Do a binary segmentation first
+    Also returns a band of pixels around the boundary, which should be
+    re-solved at full resolution.
+    """
+
+    scale = 2**opt.c2flevels
+    _h, _w = (img.shape[0]//scale)*scale, (img.shape[1]//scale)*scale
+    small = img[:_h, :_w].astype(np.float32).reshape(
+        _h//scale, scale, _w//scale, scale, -1).mean((1, 3))
+    small = (small+0.5).astype(np.uint8)
+
+    ucost = np.zeros([small.shape[0], small.shape[1], 2], np.int32)
+    ucost[:, :, 0] = ((unary(small, opt)-0.5)*opt.uwt).astype(np.int32)
+    if prev is not None:
+        pmask = (prev[:_h, :_w] > 0).reshape(
+            _h//scale, scale, _w//scale, scale).mean((1, 3)) > 0.5
+        ucost[pmask, 0] = ucost[pmask, 0] + opt.zwt
+
+    # Boundaries are 1/scale as long at this scale, relative to areas
+    ewts = [(f*opt.ewt/scale).astype(np.int32) for f in pairwise(small, opt)]
+    pwcost = 1 - np.eye(2, dtype=np.int32)
+    coarse = cut(ucost, pwcost, ewts, opt, 'coarse').reshape(small.shape[:2])
+
+    init = np.repeat(np.repeat(coarse, scale, 0), scale, 1)
+    init = np.pad(init, [[0, img.shape[0]-_h], [0, img.shape[1]-_w]], 'edge')
+    size = 2*opt.c2fband+1
+    band = ndi.maximum_filter(init, size) != ndi.minimum_filter(init, size)
+    band[_h:, :], band[:, _w:] = True, True
+
+    return init, band
+
+
+def features(img, opt=_PLOPT):
+    """Unary likelihood and pairwise edge weights (before weighting)."""
+    with trace.stage('unary'):
+        ulike = unary(img, opt)
+    with trace.stage('pairwise'):
+        ewts = pairwise(img, opt)
+    return ulike, ewts
+
+
+def binarycut(img, prev, opt=_PLOPT, feats=None):
+    """Plant vs background segmentation, along with costs used for it.
+
+    Pass feats, as returned by features(img, opt), to avoid recomputing
+    them (e.g., when they are shared by different options).
+    """
+
+    ulike, ewts = features(img, opt) if feats is None else feats
     ucost = np.zeros([img.shape[0], img.shape[1], 2], np.int32)
-    ucost0 = ((unary(img, opt)-0.5)*opt.uwt).astype(np.int32)
+    ucost0 = ((ulike-0.5)*opt.uwt).astype(np.int32)
     ucost[:, :, 0] = ucost0
     pwcost = 1 - np.eye(2, dtype=np.int32)
     if prev is not None:
         ucost[prev > 0, 0] = ucost[prev > 0, 0] + opt.zwt
-
-    ewts = pairwise(img, opt)
     ewts = [(f*opt.ewt).astype(np.int32) for f in ewts]
 
-    binary = gco.cut_grid_graph(ucost, pwcost, *ewts).reshape(img.shape[:2])
+    if opt.c2flevels > 0:
+        with trace.stage('coarse'):
+            init, band = coarsecut(img, prev, opt)
+        binary = bandcut(ucost, pwcost, ewts, init, band, opt.tilethreads,
+                         lambda uc, pw, ew: cut(uc, pw, ew, opt, 'band'))
+    elif opt.tilesize > 0:
+        binary = tiledcut(ucost, pwcost, ewts, opt.tilesize, opt.tileoverlap,
+                          opt.tilethreads,
+                          lambda uc, pw, ew: cut(uc, pw, ew, opt, 'tile'))
+    else:
+        binary = cut(ucost, pwcost, ewts, opt, 'binary').reshape(
+            img.shape[:2])
+
+    return binary, ucost0, ewts
+
+
+def label(img, prev, opt=_PLOPT, feats=None):
+    """Label all plants in an image, using previous labels as guide."""
+
+    # Do a binary segmentation first
+    binary, ucost0, ewts = binarycut(img, prev, opt, feats)
 
     # Then label individual plants
-    plants = separateconnect(binary, prev, ucost0, ewts, opt)
+    with trace.stage('separate'):
+        plants = separateconnect(binary, prev, ucost0, ewts, opt)
 
     return plants
@@ -0,0 +1,65 @@
+"""Render label overlays for the clean-up apps, with an LRU cache.
+
+Overlays are palette PNGs: every label maps to one of the CMAP colours (or
+to black for background, or white for removed labels) through a lookup
+table built once per frame, and the palette carries the alpha values, so
+that browsers show exactly the same RGBA image as a full-colour PNG would.
+"""
+
+import io
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from .utils import CMAP
+
+
+# Palette index 0 is background, 1 to len(CMAP) are label colours, and the
+# last one is for removed labels.
+_REMOVED = CMAP.shape[0] + 1
+_PALETTE = np.zeros((CMAP.shape[0]+2, 4), np.uint8)
+_PALETTE[1:_REMOVED, :3] = CMAP.astype(np.float32)*np.float32(255)
+_PALETTE[:_REMOVED, 3] = np.float32(0.5)*np.float32(255)
+_PALETTE[_REMOVED, :] = 255
+
+
+def render(lbl, removed=()):
+    """Overlay PNG (as bytes) of label image, with removed labels white."""
+    lut = np.arange(max([int(np.amax(lbl))] + list(removed)) + 1)
+    lut = (lut % CMAP.shape[0] + 1).astype(np.uint8)
+    lut[0] = 0
+    lut[[r for r in removed if r >= 0]] = _REMOVED
+
+    img = Image.fromarray(lut[lbl], 'P')
+    img.putpalette(_PALETTE[:, :3].tobytes())
+    mem = io.BytesIO()
+    img.save(mem, format='PNG', compress_level=1,
+             transparency=_PALETTE[:, 3].tobytes())
+    return mem.getvalue()
+
+
+class Cache:
+    """Least-recently-used cache of rendered overlays."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, func):
+        """Return cached value for key, or func() (and cache it)."""
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+        value = func()
+        with self.lock:
+            self.items[key] = value
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        return value
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self.lock:
+            self.items.clear()
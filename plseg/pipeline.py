@@ -0,0 +1,111 @@
+"""Background reader and writer stages to overlap I/O with computation."""
+
+import threading
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+_DONE = object()
+
+
+def prefetch(func, items, depth=4):
+    """Iterate over func(item) for all items, computed ahead in a thread.
+
+    At most depth results are kept waiting, to bound memory. Exceptions
+    raised by func are re-raised when the corresponding result is reached.
+    """
+
+    if depth <= 0:
+        for item in items:
+            yield func(item)
+        return
+
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _reader():
+        for item in items:
+            if stop.is_set():
+                break
+            try:
+                res = (func(item), None)
+            except Exception as err:  # Hand over to consumer
+                res = (None, err)
+            queue.put(res)
+            if res[1] is not None:
+                break
+        queue.put((_DONE, None))
+
+    thread = threading.Thread(target=_reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            res, err = queue.get()
+            if err is not None:
+                raise err
+            if res is _DONE:
+                break
+            yield res
+    finally:
+        stop.set()
+        while thread.is_alive():  # Unblock reader if queue is full
+            while not queue.empty():
+                queue.get()
+            thread.join(0.01)
+
+
+class Writer:
+    """Run calls (e.g., image saves) in background threads.
+
+    Use depth=0 to run calls synchronously. Otherwise, submit blocks when
+    more than depth calls are pending, and errors are re-raised on close.
+    """
+
+    def __init__(self, depth=4, nthreads=2):
+        self.depth = depth
+        self.pool, self.pending = None, []
+        if depth > 0:
+            self.pool = ThreadPoolExecutor(nthreads)
+            self.slots = threading.Semaphore(depth)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) to be run."""
+        if self.pool is None:
+            func(*args, **kwargs)
+            return
+
+        # Check and drop the same snapshot of finished calls, so that none
+        # finishing in between is dropped unchecked.
+        done = [f for f in self.pending if f.done()]
+        for _f in done:
+            if _f.exception() is not None:
+                raise _f.exception()
+        self.pending = [f for f in self.pending if f not in done]
+
+        self.slots.acquire()
+        fut = self.pool.submit(func, *args, **kwargs)
+        fut.add_done_callback(lambda _: self.slots.release())
+        self.pending.append(fut)
+
+    def flush(self):
+        """Wait for calls submitted so far, and raise first error if any."""
+        for _f in self.pending:
+            if _f.exception() is not None:
+                raise _f.exception()
+        self.pending = []
+
+    def close(self):
+        """Wait for all pending calls, and raise first error if any."""
+        if self.pool is None:
+            return
+        self.pool.shutdown(wait=True)
+        for _f in self.pending:
+            if _f.exception() is not None:
+                raise _f.exception()
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
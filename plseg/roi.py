@@ -3,33 +3,80 @@
 
 import os
 import json
+import threading
+from queue import Queue
 from glob import glob
 import flask
 import numpy as np
+from PIL import Image
 from . import utils as ut
 
 
 APP = flask.Flask("plseg-roi")
+APP.cachedir = None
+APP.psize = 0
+APP.queue = Queue()
+# Seconds browsers may cache an image before checking if it has changed
+APP.imgage = 24*3600
+
+
+def preview(seqid, idx):
+    """Path of cached downscaled preview of an image, creating if needed.
+
+    Previews are JPEGs with longest side APP.psize, kept in APP.cachedir,
+    and are re-created if the source image is newer. Returns the path of
+    the source image itself if previews are disabled.
+    """
+    fname = ut.getimglist(APP.srcdir+"/"+APP.flist[seqid])[idx]
+    if APP.psize <= 0:
+        return fname
+
+    stem = fname.split('/')[-1].rsplit('.', 1)[0]
+    pdir = f'{APP.cachedir}/{APP.flist[seqid]}'
+    pname = f'{pdir}/{stem}.{APP.psize}.jpg'
+    if os.path.isfile(pname) and \
+       os.path.getmtime(pname) >= os.path.getmtime(fname):
+        return pname
+
+    os.makedirs(pdir, exist_ok=True)
+    with Image.open(fname) as img:
+        img.draft('RGB', (APP.psize, APP.psize))
+        img = img.convert('RGB')
+        img.thumbnail((APP.psize, APP.psize), Image.BICUBIC)
+        tmpname = f'{pname}.{threading.get_ident()}.tmp'
+        img.save(tmpname, 'JPEG', quality=90)
+    os.replace(tmpname, pname)
+    return pname
+
+
+def prewarm():
+    """Create previews queued in APP.queue, in the background."""
+    while True:
+        seqid, idx = APP.queue.get()
+        try:
+            preview(seqid, idx)
+        except Exception:  # Will be retried (and reported) when requested
+            pass
 
 
 @APP.route("/", methods=["GET"])
 def index():
     """Return html file."""
-    return flask.send_file(APP.ldir+"/cset.html", cache_timeout=0)
+    return flask.send_file(APP.ldir+"/cset.html", max_age=0)
 
 
 @APP.route("/cset.js", methods=["GET"])
 def csetjs():
     """Return javascript file."""
-    return flask.send_file(APP.ldir+"/cset.js", cache_timeout=0)
+    return flask.send_file(APP.ldir+"/cset.js", max_age=0)
 
 
 @APP.route("/img/<imid>", methods=["GET"])
 def getimg(imid):
     """Return image given directory id + skip."""
     imid = [int(f) for f in imid.split(":")]
-    flist = ut.getimglist(APP.srcdir+"/"+APP.flist[imid[0]])
-    return flask.send_file(flist[imid[1]], cache_timeout=0)
+    return flask.send_file(preview(imid[0], imid[1]), conditional=True,
+                           max_age=APP.imgage)
 
 
 @APP.route("/save/<int:seqid>", methods=["POST"])
@@ -49,9 +96,9 @@ def saveinfo(seqid):
         ylim = [ylim[1], ylim[0]]
 
     flist = ut.getimglist(info['source'])
-    img = ut.imread(flist[info['skip']])
-    shape = [int(img.shape[0]*info['scale']/100),
-             int(img.shape[1]*info['scale']/100)]
+    shape = ut.imsize(flist[info['skip']])
+    shape = [int(shape[0]*info['scale']/100),
+             int(shape[1]*info['scale']/100)]
     xls = np.asarray(xlim, dtype=np.float64) * shape[1]
     yls = np.asarray(ylim, dtype=np.float64) * shape[0]
     info['xlim'] = [int(xls[0]), int(xls[1])]
@@ -87,9 +134,9 @@ def getinfo(seqid):
                 data = json.load(_f)
             info['scale'] = data['scale']
             info['skip'] = data['skip']
-            img = ut.imread(flist[info['skip']])
-            shape = [int(img.shape[0]*info['scale']/100),
-                     int(img.shape[1]*info['scale']/100)]
+            shape = ut.imsize(flist[info['skip']])
+            shape = [int(shape[0]*info['scale']/100),
+                     int(shape[1]*info['scale']/100)]
             xls = np.asarray(data['xlim'], dtype=np.float64) / shape[1]
             yls = np.asarray(data['ylim'], dtype=np.float64) / shape[0]
             info['xlim'], info['ylim'] = list(xls), list(yls)
@@ -106,13 +153,34 @@ def dlist():
     return flask.json.jsonify(APP.flist)
 
 
-def main(srcdir, destdir, port=8888):
-    """Run server"""
+def main(srcdir, destdir, port=8888, psize=1600, cachedir=None,
+         warm=False):
+    """Run server.
+
+    Images are shown as previews with longest side psize (or at full size
+    if psize is 0), cached in cachedir (default: destdir/.previews). If
+    warm is True, previews of the first frame shown for each sequence are
+    created in a background thread at the start.
+    """
     APP.ldir = "/".join(__file__.split('/')[:-1]) + '/jshtml'
     APP.srcdir = srcdir.rstrip("/")
     APP.destdir = destdir.rstrip("/")
+    APP.psize = psize
+    APP.cachedir = cachedir or APP.destdir+"/.previews"
 
     APP.flist = sorted([f.split('/')[-1] for f in glob(srcdir+'/*')
                         if os.path.isdir(f)])
 
+    if psize > 0 and warm:
+        threading.Thread(target=prewarm, daemon=True).start()
+        for seqid in range(len(APP.flist)):
+            skip = 0
+            try:
+                with open(APP.destdir+"/"+APP.flist[seqid]
+                          + '/caopt.json', 'r') as _f:
+                    skip = json.load(_f)['skip']
+            except (OSError, ValueError, KeyError):
+                pass
+            APP.queue.put((seqid, skip))
+
     APP.run(port=port)
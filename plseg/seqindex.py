@@ -0,0 +1,109 @@
+"""Cached listings of image sequence directories.
+
+Each directory is listed with a single scan, and the listing is re-used
+until the directory's mtime changes. Listings can also be persisted as
+small JSON index files in a separate directory (set by the PLSEG_INDEX
+environment variable, or INDEXDIR), so that they are shared between
+processes and runs.
+"""
+
+import os
+import json
+import time
+import hashlib
+from fnmatch import fnmatchcase
+
+
+INDEXDIR = os.environ.get('PLSEG_INDEX')
+
+# Listings taken within this long of a directory's mtime are not trusted,
+# since files added in the same mtime tick would not change it.
+_SLACK = 2*10**9
+_CACHE = {}
+
+
+def _indexfile(dname):
+    """Index file name for (absolute) directory path."""
+    return INDEXDIR + '/' + hashlib.sha1(dname.encode()).hexdigest() + '.json'
+
+
+def _loadindex(dname):
+    """Load persisted listing of directory, or None."""
+    try:
+        with open(_indexfile(dname), 'r') as _f:
+            entry = json.load(_f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('dir') != dname:
+        return None
+    entry['files'], entry['derived'] = tuple(entry['files']), {}
+    return entry
+
+
+def _saveindex(entry):
+    """Persist listing of directory."""
+    os.makedirs(INDEXDIR, exist_ok=True)
+    fname = _indexfile(entry['dir'])
+    tmpname = f'{fname}.{os.getpid()}.tmp'
+    with open(tmpname, 'w') as _f:
+        json.dump({'dir': entry['dir'], 'mtime': entry['mtime'],
+                   'listed': entry['listed'],
+                   'files': list(entry['files'])}, _f)
+    os.replace(tmpname, fname)
+
+
+def _entry(dname):
+    """Cached listing of a directory, re-listing it if needed."""
+    dname = os.path.abspath(dname)
+    if not os.path.isdir(dname):
+        return {'files': (), 'derived': {}}
+    mtime = os.stat(dname).st_mtime_ns
+    entry = _CACHE.get(dname)
+    if entry is None and INDEXDIR:
+        entry = _loadindex(dname)
+    if entry is not None and entry['mtime'] == mtime \
+       and entry['listed'] > mtime + _SLACK:
+        _CACHE[dname] = entry
+        return entry
+
+    listed = time.time_ns()
+    with os.scandir(dname) as scan:
+        files = tuple(sorted(e.name for e in scan
+                             if not e.name.startswith('.')))
+    entry = {'dir': dname, 'mtime': mtime, 'listed': listed,
+             'files': files, 'derived': {}}
+    _CACHE[dname] = entry
+    if INDEXDIR and listed > mtime + _SLACK:
+        try:
+            _saveindex(entry)
+        except OSError:
+            pass
+    return entry
+
+
+def listdir(dname):
+    """Sorted names of all (non-hidden) entries in a directory."""
+    return _entry(dname)['files']
+
+
+def matching(dname, pattern):
+    """Sorted paths of files in directory matching a glob pattern."""
+    entry = _entry(dname)
+    if pattern not in entry['derived']:
+        entry['derived'][pattern] = [f for f in entry['files']
+                                     if fnmatchcase(f, pattern)]
+    return [dname+'/'+f for f in entry['derived'][pattern]]
+
+
+def images(dname):
+    """Sorted paths of images in a sequence directory.
+
+    Returns whichever of .jpg, .jpeg, or .png files are most numerous (in
+    that order of preference if tied).
+    """
+    best = []
+    for ext in ['jpg', 'jpeg', 'png']:
+        fnames = matching(dname, '*.'+ext)
+        if len(fnames) > len(best):
+            best = fnames
+    return best
@@ -0,0 +1,93 @@
+"""Min-cut solvers for grid graphs with LR-UD-DR-DL edges.
+
+All solvers take an H x W x L int32 unary cost, an L x L pairwise cost, and
+the four edge weight maps (as returned by costs.pairwise, after scaling),
+and return the flattened H*W labels, like gco.cut_grid_graph.
+"""
+
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_flow, breadth_first_order
+import gco
+
+
+# Functions called as hook(stage, shape, seconds) after every cut, where
+# shape is that of the unary cost.
+HOOKS = []
+
+
+def gcocut(ucost, pwcost, ewts, opt):
+    """Cut with gco's alpha-expansion (or alpha-beta swap)."""
+    return gco.cut_grid_graph(ucost, pwcost, *ewts, n_iter=opt.solveriter,
+                              algorithm=opt.solveralgo)
+
+
+def _gridedges(shape):
+    """Node indices of endpoints of LR-UD-DR-DL edges of a grid."""
+    idx = np.arange(shape[0]*shape[1], dtype=np.int32).reshape(shape)
+    return [(idx[:-1, :], idx[1:, :]), (idx[:, :-1], idx[:, 1:]),
+            (idx[:-1, :-1], idx[1:, 1:]), (idx[:-1, 1:], idx[1:, :-1])]
+
+
+def stcut(ucost, pwcost, ewts, opt):
+    """Exact binary cut with a single s-t max-flow.
+
+    Only handles two labels with Potts-like pairwise costs, and uses gcocut
+    for everything else.
+    """
+
+    if ucost.shape[2] != 2 or pwcost[0, 0] != 0 or pwcost[1, 1] != 0 \
+       or pwcost[0, 1] != pwcost[1, 0]:
+        return gcocut(ucost, pwcost, ewts, opt)
+
+    shape = ucost.shape[:2]
+    npix = shape[0]*shape[1]
+    src, sink = npix, npix+1
+    ucost = ucost.reshape(npix, 2).astype(np.int64)
+    ucost = ucost - np.amin(ucost, 1, keepdims=True)
+
+    # Pixels left connected to the source after the cut get label 0, so the
+    # edge from the source is cut (and pays) for label 1, and vice-versa.
+    nodes = np.arange(npix, dtype=np.int32)
+    rows = [np.full(npix, src, np.int32), nodes]
+    cols = [nodes, np.full(npix, sink, np.int32)]
+    caps = [ucost[:, 1], ucost[:, 0]]
+    for (_p, _q), wts in zip(_gridedges(shape), ewts):
+        wts = wts.flatten().astype(np.int64)*int(pwcost[0, 1])
+        rows += [_p.flatten(), _q.flatten()]
+        cols += [_q.flatten(), _p.flatten()]
+        caps += [wts, wts]
+
+    caps = np.concatenate(caps)
+    keep = caps > 0
+    graph = csr_matrix((caps[keep].astype(np.int32),
+                        (np.concatenate(rows)[keep],
+                         np.concatenate(cols)[keep])),
+                       shape=(npix+2, npix+2))
+    flow = maximum_flow(graph, src, sink)
+    flow = flow.flow if hasattr(flow, 'flow') else flow.residual
+
+    resid = graph - flow
+    resid.data[resid.data < 0] = 0
+    resid.eliminate_zeros()
+    reach = breadth_first_order(resid, src, directed=True,
+                                return_predecessors=False)
+
+    labels = np.ones(npix+2, np.int32)
+    labels[reach] = 0
+    return labels[:npix]
+
+
+SOLVERS = {'gco': gcocut, 'maxflow': stcut}
+
+
+def cut(ucost, pwcost, ewts, opt, stage='cut'):
+    """Cut with solver chosen by opt.solver, and report time to HOOKS."""
+    start = time.perf_counter()
+    labels = SOLVERS[opt.solver](ucost, pwcost, ewts, opt)
+    if HOOKS:
+        secs = time.perf_counter()-start
+        for hook in HOOKS:
+            hook(stage, ucost.shape, secs)
+    return labels
@@ -0,0 +1,161 @@
+"""Compact label volumes, stored as bounding-box cropped masks.
+
+A .plr file stores, for every label present in every frame, the mask of
+that label within its bounding box, as compressed packed bits. An index of
+all these (frame, label, bounding box, data offset and size) is kept at the
+end of the file, so that decoding a frame, or getting the masks of one
+label across frames, only reads the data needed for it.
+"""
+
+import json
+import zlib
+import struct
+import numpy as np
+import scipy.ndimage as ndi
+
+
+_MAGIC = b'PLSPARS1'
+_FOOTER = struct.Struct('<QQQ')
+# Index columns
+_T, _L, _Y0, _X0, _Y1, _X1, _OFF, _LEN = range(8)
+
+
+class SparseWriter:
+    """Write label frames to a .plr file.
+
+    The volume's dtype is that of the first frame, unless specified.
+    """
+
+    def __init__(self, fname, dtype=None, level=6):
+        self.level = level
+        self.shape, self.dtype = None, dtype
+        self.rows, self.nframes = [], 0
+        self._f = open(fname, 'wb')
+        self._f.write(_MAGIC)
+
+    def append(self, seg):
+        """Write next label frame."""
+        seg = np.asarray(seg)
+        if self.shape is None:
+            self.shape = seg.shape
+            self.dtype = np.dtype(self.dtype or seg.dtype)
+        elif seg.shape != self.shape:
+            raise ValueError(f'Expected {self.shape} frame, got {seg.shape}.')
+
+        for _i, box in enumerate(ndi.find_objects(seg)):
+            if box is None:
+                continue
+            data = zlib.compress(np.packbits(seg[box] == _i+1).tobytes(),
+                                 self.level)
+            self.rows.append([self.nframes, _i+1, box[0].start,
+                              box[1].start, box[0].stop, box[1].stop,
+                              self._f.tell(), len(data)])
+            self._f.write(data)
+        self.nframes = self.nframes + 1
+
+    def close(self):
+        """Write index, and finish writing."""
+        if self._f is None:
+            return
+        offset = self._f.tell()
+        index = np.asarray(self.rows, np.int64).reshape(-1, 8)
+        meta = json.dumps({'shape': list(self.shape or [0, 0])
+                           + [self.nframes],
+                           'dtype': np.dtype(self.dtype or np.uint8).str})
+        self._f.write(index.astype('<i8').tobytes())
+        self._f.write(meta.encode())
+        self._f.write(_FOOTER.pack(offset, len(index), len(meta)) + _MAGIC)
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SparseLabels:
+    """Read label volume from a .plr file, decoding only what is accessed.
+
+    Supports indexing like an H x W x N array as long as a single frame is
+    selected, e.g., labels[y1:y2, :, t], including assignment. Changed
+    frames are only kept in memory, and never written back to the file.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as _f:
+            _f.seek(-_FOOTER.size-len(_MAGIC), 2)
+            footer = _f.read()
+            if footer[_FOOTER.size:] != _MAGIC:
+                raise ValueError(f'{fname} is not a complete .plr file.')
+            offset, nrows, mlen = _FOOTER.unpack(footer[:_FOOTER.size])
+            _f.seek(offset)
+            self.index = np.frombuffer(_f.read(nrows*64), '<i8').reshape(
+                nrows, 8).astype(np.int64)
+            meta = json.loads(_f.read(mlen))
+
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.starts = np.searchsorted(self.index[:, _T],
+                                      np.arange(self.shape[2]+1))
+        self.bylabel = np.lexsort((self.index[:, _T], self.index[:, _L]))
+        self.ids = np.unique(self.index[:, _L])
+        self.edited = {}
+
+    def __len__(self):
+        return self.shape[2]
+
+    def _masks(self, _f, rows):
+        """Decode masks of rows of the index, in order."""
+        masks = []
+        for row in rows:
+            _f.seek(row[_OFF])
+            bits = np.frombuffer(zlib.decompress(_f.read(row[_LEN])),
+                                 np.uint8)
+            shape = (row[_Y1]-row[_Y0], row[_X1]-row[_X0])
+            masks.append(np.unpackbits(bits, count=shape[0]*shape[1])
+                         .reshape(shape).astype(bool))
+        return masks
+
+    def frame(self, idx):
+        """Get label image of frame idx."""
+        if idx < 0:
+            idx = idx + self.shape[2]
+        if idx in self.edited:
+            return self.edited[idx]
+        rows = self.index[self.starts[idx]:self.starts[idx+1]]
+        seg = np.zeros(self.shape[:2], self.dtype)
+        with open(self.fname, 'rb') as _f:
+            for row, mask in zip(rows, self._masks(_f, rows)):
+                seg[row[_Y0]:row[_Y1], row[_X0]:row[_X1]][mask] = row[_L]
+        return seg
+
+    def track(self, label):
+        """Masks of a label across frames.
+
+        Returns a list of (frame, (y0, x0, y1, x1), mask) for every frame the
+        label is present in, where mask is the label's mask cropped to the
+        bounding box [y0, y1) x [x0, x1). Ignores changes to frames.
+        """
+        start, end = np.searchsorted(self.index[self.bylabel, _L],
+                                     [label, label+1])
+        rows = self.index[self.bylabel[start:end]]
+        with open(self.fname, 'rb') as _f:
+            masks = self._masks(_f, rows)
+        return [(int(_r[_T]), tuple(int(_v) for _v in _r[_Y0:_X1+1]), _m)
+                for _r, _m in zip(rows, masks)]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple):
+            return self.frame(idx[2])[idx[:2]]
+        return self.frame(idx)
+
+    def __setitem__(self, idx, value):
+        if not isinstance(idx, tuple):
+            idx = (slice(None), slice(None), idx)
+        tidx = idx[2] + self.shape[2] if idx[2] < 0 else idx[2]
+        seg = self.frame(tidx).copy()
+        seg[idx[:2]] = value
+        self.edited[tidx] = seg
@@ -0,0 +1,119 @@
+"""Single-file stack of compressed per-frame arrays, with random access.
+
+A stack file starts with a magic string, followed by one record per frame.
+Each record is a fixed header giving the sizes of a JSON description (dtype,
+shape, and any extra metadata) and of the zlib-compressed array data that
+follow it. Records are only ever appended, so a partially written stack
+(e.g., from an interrupted job) can be read up to its last complete record.
+"""
+
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+
+_MAGIC = b'PLSTACK1'
+_RECORD = struct.Struct('<IQ')
+
+
+class StackWriter:
+    """Append frames to a stack file.
+
+    If append is True, continue writing to an existing stack, keeping only
+    its first keep frames if keep is specified.
+    """
+
+    def __init__(self, fname, append=False, keep=None, level=1):
+        self.fname, self.level = fname, level
+        if append and os.path.isfile(fname):
+            offsets = scan(fname)[0]
+            if keep is not None:
+                if keep > len(offsets):
+                    raise ValueError(f'{fname} has only {len(offsets)} '
+                                     + f'frames, expected {keep}.')
+                offsets = offsets[:keep]
+            self.nframes = len(offsets)
+            self._f = open(fname, 'r+b')
+            self._f.truncate(offsets[-1][1] if len(offsets) > 0
+                             else len(_MAGIC))
+            self._f.seek(0, os.SEEK_END)
+        else:
+            self.nframes = 0
+            self._f = open(fname, 'wb')
+            self._f.write(_MAGIC)
+
+    def append(self, arr, **meta):
+        """Write array as next frame, with optional JSON-able metadata."""
+        arr = np.ascontiguousarray(arr)
+        meta = dict(meta, dtype=arr.dtype.str, shape=list(arr.shape))
+        meta = json.dumps(meta).encode()
+        data = zlib.compress(arr.data, self.level)
+        self._f.write(_RECORD.pack(len(meta), len(data)) + meta)
+        self._f.write(data)
+        self.nframes = self.nframes + 1
+
+    def flush(self):
+        """Make sure all frames appended so far are on disk."""
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        """Finish writing."""
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def scan(fname):
+    """Get (offset, end) of data, and metadata, of each complete record."""
+    offsets, metas = [], []
+    with open(fname, 'rb') as _f:
+        if _f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f'{fname} is not a stack file.')
+        fsize = os.fstat(_f.fileno()).st_size
+        pos = len(_MAGIC)
+        while pos + _RECORD.size <= fsize:
+            mlen, dlen = _RECORD.unpack(_f.read(_RECORD.size))
+            meta = _f.read(mlen)
+            pos = pos + _RECORD.size + mlen
+            if len(meta) < mlen or pos + dlen > fsize:
+                break
+            offsets.append((pos, pos+dlen))
+            metas.append(json.loads(meta))
+            pos = pos + dlen
+            _f.seek(pos)
+    return offsets, metas
+
+
+class Stack:
+    """Read frames from a stack file, decompressing only those accessed."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.offsets, self.metas = scan(fname)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx = idx + len(self)
+        start, end = self.offsets[idx]
+        with open(self.fname, 'rb') as _f:
+            _f.seek(start)
+            data = zlib.decompress(_f.read(end-start))
+        meta = self.metas[idx]
+        return np.frombuffer(data, np.dtype(meta['dtype'])).reshape(
+            meta['shape'])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
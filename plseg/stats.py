@@ -0,0 +1,127 @@
+"""Per-label, per-frame statistics of label volumes.
+
+Statistics are saved as stats.npz, with one row for every label present in
+every frame (sorted by frame, then label), giving its area in pixels, its
+centroid (y, x), and its bounding box (y0, x0, y1, x1, with y1 and x1 one
+past the end), along with the first and last frame of every label.
+"""
+
+import numpy as np
+import scipy.ndimage as ndi
+
+
+class Builder:
+    """Compute statistics of label frames as they come."""
+
+    def __init__(self):
+        self.rows = []
+        self.grid = None
+
+    @property
+    def nframes(self):
+        """Number of frames added so far."""
+        return len(self.rows)
+
+    def append(self, seg):
+        """Add statistics of next label frame."""
+        seg = np.asarray(seg)
+        if self.grid is None or self.grid[0].shape != seg.shape:
+            self.grid = np.indices(seg.shape, np.float64)
+
+        boxes = ndi.find_objects(seg)
+        ids = np.asarray([_i+1 for _i, _b in enumerate(boxes)
+                          if _b is not None], np.int32)
+        bbox = np.asarray([[_b[0].start, _b[1].start, _b[0].stop,
+                            _b[1].stop] for _b in boxes if _b is not None],
+                          np.int32).reshape(-1, 4)
+
+        flat = seg.ravel()
+        nbins = len(boxes)+1
+        area = np.bincount(flat, minlength=nbins)[ids]
+        cent = np.stack([np.bincount(flat, _g.ravel(), nbins)[ids]
+                         for _g in self.grid], 1) / area[:, None]
+        self.rows.append((ids, area.astype(np.int64), cent, bbox))
+
+    def arrays(self):
+        """Statistics as a dictionary of arrays (as saved in stats.npz)."""
+        empty = (np.zeros((0,), np.int32), np.zeros((0,), np.int64),
+                 np.zeros((0, 2), np.float64), np.zeros((0, 4), np.int32))
+        label, area, cent, bbox = [np.concatenate(_c) for _c in
+                                   zip(*([empty] + self.rows))]
+        frame = np.repeat(np.arange(self.nframes, dtype=np.int32),
+                          [len(_r[0]) for _r in self.rows])
+
+        ids, first = np.unique(label, return_index=True)
+        last = len(label) - 1 - np.unique(label[::-1], return_index=True)[1]
+        return {'label': label, 'frame': frame, 'area': area,
+                'centroid': cent, 'bbox': bbox, 'ids': ids,
+                'first': frame[first], 'last': frame[last],
+                'nframes': np.int32(self.nframes)}
+
+    def save(self, fname):
+        """Save statistics to npz file."""
+        np.savez_compressed(fname, **self.arrays())
+
+
+def compute(labels):
+    """Statistics of an H x W x N label volume (array or LabelStore)."""
+    builder = Builder()
+    for _t in range(labels.shape[-1]):
+        builder.append(labels[:, :, _t])
+    return Stats(builder.arrays())
+
+
+class Stats:
+    """Look up statistics saved in stats.npz (or from Builder.arrays)."""
+
+    def __init__(self, src):
+        data = np.load(src) if isinstance(src, str) else src
+        for key in ['label', 'frame', 'area', 'centroid', 'bbox', 'ids',
+                    'first', 'last']:
+            setattr(self, key, data[key])
+        self.nframes = int(data['nframes'])
+        self.bylabel = np.lexsort((self.frame, self.label))
+        self.sorted = self.label[self.bylabel]
+
+    def __len__(self):
+        return len(self.label)
+
+    def rows(self, frame):
+        """Slice of rows of a frame."""
+        return slice(*np.searchsorted(self.frame, [frame, frame+1]))
+
+    def labels(self, frame):
+        """Labels present in a frame."""
+        return self.label[self.rows(frame)]
+
+    def track(self, label):
+        """Indices of rows of a label, in order of frame."""
+        start, end = np.searchsorted(self.sorted, [label, label+1])
+        return self.bylabel[start:end]
+
+    def span(self, label):
+        """First and last frame of label, or None if it never appears."""
+        idx = np.searchsorted(self.ids, label)
+        if idx == len(self.ids) or self.ids[idx] != label:
+            return None
+        return int(self.first[idx]), int(self.last[idx])
+
+    def find(self, label, frame):
+        """Index of row of label in frame, or None if it isn't present."""
+        rows = self.rows(frame)
+        idx = rows.start + np.searchsorted(self.label[rows], label)
+        if idx == rows.stop or self.label[idx] != label:
+            return None
+        return int(idx)
+
+    def inbox(self, frame, y0, y1, x0, x1):
+        """Labels in frame with bounding boxes overlapping a box.
+
+        This is a superset of labels with pixels inside the box, since
+        bounding boxes can overlap it without the label itself doing so.
+        """
+        rows = self.rows(frame)
+        bbox = self.bbox[rows]
+        hit = (bbox[:, 0] < y1) & (bbox[:, 2] > y0) & \
+            (bbox[:, 1] < x1) & (bbox[:, 3] > x0)
+        return self.label[rows][hit]
@@ -0,0 +1,50 @@
+"""Segment the same frames with many options, sharing cost features.
+
+The unary likelihood only depends on grthresh and grsensitivity, and the
+pairwise edge weights only on fsz, fsgm, fsensitivity and fmethod, so each
+is computed once per frame for every distinct value of these fields, and
+shared by all options with those values.
+"""
+
+import itertools
+from dataclasses import fields, replace
+from .costs import unary, pairwise
+from . import trace
+
+
+UNARY = ('grthresh', 'grsensitivity')
+PAIRWISE = ('fsz', 'fsgm', 'fsensitivity', 'fmethod')
+
+
+def grid(base, values):
+    """List of options for every combination of values of some fields.
+
+    Values should be a dict mapping field names to lists of values, and
+    all other fields are set as in base.
+    """
+    keys = list(values.keys())
+    return [replace(base, **dict(zip(keys, vals)))
+            for vals in itertools.product(*[values[k] for k in keys])]
+
+
+def confname(opt, base):
+    """Name for options, from the fields that differ from base."""
+    diff = [f'{f.name}{getattr(opt, f.name)}' for f in fields(opt)
+            if getattr(opt, f.name) != getattr(base, f.name)]
+    return '-'.join(diff) if len(diff) > 0 else 'base'
+
+
+def sharedfeatures(img, opts):
+    """Features of img for each of a list of options, computing each once."""
+    ucache, pcache, feats = {}, {}, []
+    for opt in opts:
+        ukey = tuple(getattr(opt, k) for k in UNARY)
+        pkey = tuple(getattr(opt, k) for k in PAIRWISE)
+        if ukey not in ucache:
+            with trace.stage('unary'):
+                ucache[ukey] = unary(img, opt)
+        if pkey not in pcache:
+            with trace.stage('pairwise'):
+                pcache[pkey] = pairwise(img, opt)
+        feats.append((ucache[ukey], pcache[pkey]))
+    return feats
@@ -0,0 +1,135 @@
+"""Solve grid graph cuts in pieces (tiles or bands), in parallel threads."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.ndimage as ndi
+import gco
+
+
+# Unary cost used to fix the label of a pixel (gco refuses terms > 1e7).
+_FIXED = 5000000
+
+
+def cropewts(ewts, _y1, _y2, _x1, _x2):
+    """Crop LR-UD-DR-DL edge weights to edges within a box."""
+    return [ewts[0][_y1:(_y2-1), _x1:_x2],
+            ewts[1][_y1:_y2, _x1:(_x2-1)],
+            ewts[2][_y1:(_y2-1), _x1:(_x2-1)],
+            ewts[3][_y1:(_y2-1), _x1:(_x2-1)]]
+
+
+def fixunary(ucost, fixed, labels):
+    """Copy of unary costs with pixels in mask fixed to given labels."""
+    ucost = ucost.copy()
+    _y, _x = np.nonzero(fixed)
+    ucost[_y, _x, :] = _FIXED
+    ucost[_y, _x, labels[_y, _x]] = 0
+    return ucost
+
+
+def _spans(size, tsize):
+    """Split [0, size) into about equal spans of around tsize."""
+    bounds = np.linspace(0, size, max(1, int(round(size/tsize)))+1)
+    bounds = bounds.astype(np.int64)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _gcocut(ucost, pwcost, ewts):
+    """Default cut for tiles."""
+    return gco.cut_grid_graph(ucost, pwcost, *ewts)
+
+
+def tiledcut(ucost, pwcost, ewts, tsize, overlap, nthreads=0, cut=_gcocut):
+    """Approximate a grid graph cut by solving tiles in parallel.
+
+    The image is split into tiles of around tsize x tsize, and each is
+    solved with cut(ucost, pwcost, ewts) after being extended by overlap
+    pixels on every side.
+    Then, strips of width 2*overlap around every seam between tiles are
+    re-solved with the labels just outside them held fixed, first across
+    horizontal seams and then vertical ones.
+    """
+
+    _h, _w = ucost.shape[:2]
+    yspans, xspans = _spans(_h, tsize), _spans(_w, tsize)
+    if len(yspans) == 1 and len(xspans) == 1:
+        return cut(ucost, pwcost, ewts).reshape(_h, _w)
+    if min([s[1]-s[0] for s in yspans+xspans]) <= 2*overlap+2:
+        raise ValueError(f'Tile size {tsize} too small for overlap '
+                         + f'{overlap}.')
+
+    out = np.zeros((_h, _w), np.int32)
+
+    def _solve(box, fixed=None):
+        _y1, _y2, _x1, _x2 = box
+        ucb = ucost[_y1:_y2, _x1:_x2]
+        if fixed is not None:
+            ucb = fixunary(ucb, fixed, out[_y1:_y2, _x1:_x2])
+        return cut(ucb, pwcost,
+                   cropewts(ewts, *box)).reshape(ucb.shape[:2])
+
+    with ThreadPoolExecutor(nthreads or os.cpu_count()) as pool:
+        # Solve extended tiles, and keep only the core of each
+        cores = [(_y1, _y2, _x1, _x2) for _y1, _y2 in yspans
+                 for _x1, _x2 in xspans]
+        boxes = [(max(0, _y1-overlap), min(_h, _y2+overlap),
+                  max(0, _x1-overlap), min(_w, _x2+overlap))
+                 for _y1, _y2, _x1, _x2 in cores]
+        for core, box, res in zip(cores, boxes, pool.map(_solve, boxes)):
+            out[core[0]:core[1], core[2]:core[3]] = \
+                res[(core[0]-box[0]):(core[1]-box[0]),
+                    (core[2]-box[2]):(core[3]-box[2])]
+
+        # Re-solve seams, holding first & last rows (or columns) fixed
+        for axis, spans in [(0, yspans), (1, xspans)]:
+            boxes, fixes = [], []
+            for seam, _ in spans[1:]:
+                lims = [seam-overlap-1, seam+overlap+1]
+                fixed = np.zeros([lims[1]-lims[0], _w] if axis == 0
+                                 else [_h, lims[1]-lims[0]], np.bool_)
+                if axis == 0:
+                    boxes.append((lims[0], lims[1], 0, _w))
+                    fixed[[0, -1], :] = True
+                else:
+                    boxes.append((0, _h, lims[0], lims[1]))
+                    fixed[:, [0, -1]] = True
+                fixes.append(fixed)
+            for box, res in zip(boxes, pool.map(_solve, boxes, fixes)):
+                out[box[0]:box[1], box[2]:box[3]] = res
+
+    return out
+
+
+def bandcut(ucost, pwcost, ewts, init, band, nthreads=0, cut=_gcocut):
+    """Re-solve a cut only for pixels in band, holding others at init.
+
+    Each connected component of band is an independent problem once the
+    pixels around it are fixed, and so these are solved in parallel, each
+    in its bounding box with all pixels outside the component fixed.
+    """
+
+    _h, _w = ucost.shape[:2]
+    comps, ncomp = ndi.label(band, np.ones((3, 3)))
+    out = init.astype(np.int32)
+    if ncomp == 0:
+        return out
+
+    boxes = [(max(0, obj[0].start-1), min(_h, obj[0].stop+1),
+              max(0, obj[1].start-1), min(_w, obj[1].stop+1))
+             for obj in ndi.find_objects(comps)]
+
+    def _solve(idx):
+        _y1, _y2, _x1, _x2 = boxes[idx]
+        mask = comps[_y1:_y2, _x1:_x2] == idx+1
+        ucb = fixunary(ucost[_y1:_y2, _x1:_x2], np.logical_not(mask),
+                       out[_y1:_y2, _x1:_x2])
+        res = cut(ucb, pwcost, cropewts(ewts, *boxes[idx]))
+        return mask, res.reshape(mask.shape)
+
+    with ThreadPoolExecutor(nthreads or os.cpu_count()) as pool:
+        results = list(pool.map(_solve, range(ncomp)))
+    for (_y1, _y2, _x1, _x2), (mask, res) in zip(boxes, results):
+        out[_y1:_y2, _x1:_x2][mask] = res[mask]
+
+    return out
@@ -0,0 +1,148 @@
+"""Optional per-frame trace of time taken by, and counts from, each stage.
+
+Code is instrumented with, e.g., `with trace.stage('unary'):` and
+`trace.count('splits')`. These do nothing unless tracing has been turned on
+with start(), and so cost only a function call otherwise. When on, times
+and counts are added to the record of the current frame (set by frame()),
+and records are written as JSON lines, one per frame, on flush().
+"""
+
+import time
+import json
+import threading
+from contextlib import nullcontext
+from . import solvers
+
+
+_TRACER = None
+_NULL = nullcontext()
+
+
+class Tracer:
+    """Collect per-frame stage times and counts for a trace file."""
+
+    def __init__(self, fname, append=False):
+        self._f = open(fname, 'a' if append else 'w')
+        self.lock = threading.Lock()
+        self.records, self.current = {}, None
+
+    def frame(self, idx, **info):
+        """Start record for frame idx, with optional extra info."""
+        with self.lock:
+            self.records[idx] = dict(info, frame=idx, sec={}, count={})
+            self.current = idx
+
+    def add(self, name, secs, idx=None):
+        """Add time taken by a stage to record of frame idx (or current)."""
+        with self.lock:
+            rec = self.records.get(self.current if idx is None else idx)
+            if rec is not None:
+                rec['sec'][name] = rec['sec'].get(name, 0.) + secs
+
+    def count(self, name, num=1):
+        """Add to a count in record of current frame."""
+        with self.lock:
+            rec = self.records.get(self.current)
+            if rec is not None:
+                rec['count'][name] = rec['count'].get(name, 0) + int(num)
+
+    def cuthook(self, stage, shape, secs):
+        """Record time, number, and number of pixels of graph cuts."""
+        self.add('cut_'+stage, secs)
+        self.count('cuts_'+stage)
+        self.count('cutpix_'+stage, shape[0]*shape[1])
+
+    def flush(self):
+        """Write records of all frames started so far."""
+        with self.lock:
+            for idx in sorted(self.records):
+                self._f.write(json.dumps(self.records[idx]) + '\n')
+            self.records = {}
+        self._f.flush()
+
+    def close(self, discard=False):
+        """Write remaining records (unless discard) and close trace file."""
+        if discard:
+            with self.lock:
+                self.records = {}
+        self.flush()
+        self._f.close()
+
+
+class _Stage:
+    """Context manager that adds time taken to a stage."""
+
+    def __init__(self, tracer, name, idx):
+        self.tracer, self.name, self.idx = tracer, name, idx
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, time.perf_counter()-self.start, self.idx)
+
+
+def start(fname, append=False):
+    """Turn on tracing, writing records to fname."""
+    global _TRACER
+    stop(discard=True)
+    _TRACER = Tracer(fname, append)
+    solvers.HOOKS.append(_TRACER.cuthook)
+
+
+def stop(discard=False):
+    """Write any remaining records (unless discard) and turn off tracing."""
+    global _TRACER
+    if _TRACER is not None:
+        solvers.HOOKS.remove(_TRACER.cuthook)
+        _TRACER.close(discard)
+        _TRACER = None
+
+
+def frame(idx, **info):
+    """Start record for frame idx."""
+    if _TRACER is not None:
+        _TRACER.frame(idx, **info)
+
+
+def stage(name, idx=None):
+    """Context manager to time a stage for frame idx (or current frame)."""
+    if _TRACER is None:
+        return _NULL
+    return _Stage(_TRACER, name, idx)
+
+
+def add(name, secs):
+    """Add time taken (measured elsewhere) by a stage for current frame."""
+    if _TRACER is not None:
+        _TRACER.add(name, secs)
+
+
+def count(name, num=1):
+    """Add to a count for the current frame."""
+    if _TRACER is not None:
+        _TRACER.count(name, num)
+
+
+def timed(func, name):
+    """Wrap func to time it as a stage of the current frame when wrapped.
+
+    Useful for calls that will be run in a background thread, after the
+    main thread has moved on to the next frame.
+    """
+    if _TRACER is None:
+        return func
+    idx = _TRACER.current
+
+    def _timed(*args, **kwargs):
+        with stage(name, idx):
+            return func(*args, **kwargs)
+    return _timed
+
+
+def flush():
+    """Write records of all frames started so far."""
+    if _TRACER is not None:
+        _TRACER.flush()
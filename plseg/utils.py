@@ -1,15 +1,38 @@
 # - Ayan Chakrabarti <ayan.chakrabarti@gmail.com>
 """Miscellaneous Utility functions."""
 
-from glob import glob
 import numpy as np
 from scipy.signal import correlate as corr
 from skimage.io import imread as skimread
 from skimage.transform import resize as imresize
+from PIL import Image
+from . import seqindex
+
+
+def _pilscaled(fname, factor):
+    """Read scaled image with PIL, or None if mode is not L, RGB, or RGBA.
+
+    JPEGs are decoded at reduced resolution (but at least twice the output
+    size), and channels are then resized separately in float32 with PIL's
+    antialiased bicubic filter.
+    """
+    with Image.open(fname) as img:
+        if img.mode not in ['L', 'RGB', 'RGBA']:
+            return None
+        size = (int(img.width*factor/100), int(img.height*factor/100))
+        img.draft(img.mode, (2*size[0], 2*size[1]))
+        chans = [np.asarray(c.convert('F').resize(size, Image.BICUBIC))
+                 for c in img.split()]
+    img = np.stack(chans, -1) if len(chans) > 1 else chans[0]
+    return np.clip(img, 0, 255).astype(np.uint8)
 
 
 def imread(fname, factor=100):
     """Read possibly scaled version of image"""
+    if factor < 100:
+        img = _pilscaled(fname, factor)
+        if img is not None:
+            return img
     img = skimread(fname)
     if factor < 100:
         img = imresize(img, [int(img.shape[0]*factor/100),
@@ -18,20 +41,40 @@ def imread(fname, factor=100):
     return img
 
 
+def imsize(fname):
+    """Get (height, width) of image from its header, without decoding."""
+    try:
+        with Image.open(fname) as img:
+            return img.height, img.width
+    except OSError:
+        return skimread(fname).shape[:2]
+
+
 def getimglist(sdir):
-    """Get list of images."""
-    jpgs = sorted(glob(sdir+'/*.jpg'))
-    jpegs = sorted(glob(sdir+'/*.jpeg'))
-    pngs = sorted(glob(sdir+'/*.png'))
-    if len(jpgs) >= len(jpegs) and len(jpgs) >= len(pngs):
-        return jpgs
-    if len(jpegs) >= len(pngs):
-        return jpegs
-    return pngs
+    """Get list of images (from cached directory listing)."""
+    return seqindex.images(sdir)
 
 
 def visualize(img, mask):
     """Produce a visualization of the segmentation."""
+    if img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 3 \
+       or mask.size == 0:
+        return _fvisualize(img, mask)
+
+    # Same output as _fvisualize, looked up from _VIZTABLE
+    ncol = CMAP.shape[0]+1
+    lut = np.arange(int(np.amax(mask)) + 1) % CMAP.shape[0] + 1
+    lut[0] = 0
+    col = lut.astype(np.uint16)[mask]
+    out = np.empty_like(img)
+    for _c in range(3):
+        out[:, :, _c] = _VIZTABLE[_c][img[:, :, _c].astype(np.uint16)*ncol
+                                      + col]
+    return out
+
+
+def _fvisualize(img, mask):
+    """Produce a visualization of the segmentation, in floating point."""
     out = np.float32(img)/255
     msk = CMAP[mask % CMAP.shape[0], :]
     msk[mask == 0, :] = 0.
@@ -39,24 +82,107 @@ def visualize(img, mask):
     return (out*255).astype(np.uint8)
 
 
-def crop_align(img, imgc):
-    """Find crop in img aligned to imgc."""
+def _ssdmap(imgpg, imgcg, ylim=None, xlim=None):
+    """SSD of imgcg to windows of imgpg at offsets in [ylim) x [xlim)."""
+
+    if ylim is None:
+        ylim = [0, imgpg.shape[0]-imgcg.shape[0]+1]
+    if xlim is None:
+        xlim = [0, imgpg.shape[1]-imgcg.shape[1]+1]
+    imgpg = imgpg[ylim[0]:(ylim[1]+imgcg.shape[0]-1),
+                  xlim[0]:(xlim[1]+imgcg.shape[1]-1)]
+
+    imgpc = np.sum(imgcg**2) - 2*corr(imgpg, imgcg, 'valid')
+    return imgpc + corr(imgpg**2, np.ones_like(imgcg), 'valid')
+
+
+def _ssdwin(imgpg, imgcg, ylim, xlim):
+    """Direct SSD of imgcg to windows of imgpg in a small offset range."""
+
+    ssd = np.zeros([ylim[1]-ylim[0], xlim[1]-xlim[0]], np.float32)
+    for _y in range(ylim[0], ylim[1]):
+        for _x in range(xlim[0], xlim[1]):
+            diff = imgpg[_y:(_y+imgcg.shape[0]),
+                         _x:(_x+imgcg.shape[1])] - imgcg
+            ssd[_y-ylim[0], _x-xlim[0]] = np.sum(diff*diff)
+    return ssd
+
+
+def _pyrdown(img):
+    """Downsample by 2 by averaging 2x2 blocks."""
+    img = img[:(img.shape[0]//2)*2, :(img.shape[1]//2)*2]
+    return 0.25*(img[0::2, 0::2] + img[1::2, 0::2]
+                 + img[0::2, 1::2] + img[1::2, 1::2])
+
+
+def _window(center, radius, scale, size):
+    """Range of offsets within radius of center (at scale), in [0, size)."""
+    if center is None or radius is None:
+        return [0, size]
+    return [max(0, min(size-1, (center-radius)//scale)),
+            max(1, min(size, (center+radius)//scale + 2))]
+
+
+def crop_align(img, imgc, method='full', center=None, radius=None,
+               levels=3, retoff=False):
+    """Find crop in img aligned to imgc.
+
+    Offsets are searched exhaustively at full resolution with method 'full',
+    or at 1/2^levels resolution and then refined by a couple of pixels at
+    each finer level with method 'pyramid'. If center and radius are given,
+    only offsets within radius of center (e.g., previous frame's offset) are
+    searched. If retoff, also returns the offset of the crop's top-left
+    corner in img (or center, if img is too dark to align). Offsets can be
+    negative, since img is zero-padded by 5% on each side.
+    """
 
     if np.amax(img) < np.amax(imgc)//2:
-        return imgc
+        return (imgc, center) if retoff else imgc
 
     _py, _px = int(0.05*imgc.shape[0]), int(0.05*imgc.shape[1])
     imgp = np.pad(img, [[_py], [_px], [0]])
 
     imgpg = np.mean(imgp.astype(np.float32), -1)
-    imgc = np.mean(imgc.astype(np.float32), -1)
-
-    imgpc = np.sum(imgc**2) - 2*corr(imgpg, imgc, 'valid')
-    imgpc = imgpc + corr(imgpg**2, np.ones_like(imgc), 'valid')
-
-    amin = np.unravel_index(np.argmin(imgpc), imgpc.shape)
-    return imgp[amin[0]:(amin[0]+imgc.shape[0]),
+    imgcg = np.mean(imgc.astype(np.float32), -1)
+    nofs = [imgpg.shape[0]-imgcg.shape[0]+1, imgpg.shape[1]-imgcg.shape[1]+1]
+    center = [None, None] if center is None else \
+        [center[0]+_py, center[1]+_px]
+
+    if method == 'full':
+        ylim = _window(center[0], radius, 1, nofs[0])
+        xlim = _window(center[1], radius, 1, nofs[1])
+        imgpc = _ssdmap(imgpg, imgcg, ylim, xlim)
+        amin = np.unravel_index(np.argmin(imgpc), imgpc.shape)
+        amin = (amin[0]+ylim[0], amin[1]+xlim[0])
+    elif method == 'pyramid':
+        pyrp, pyrc = [imgpg], [imgcg]
+        for _ in range(levels):
+            pyrp.append(_pyrdown(pyrp[-1]))
+            pyrc.append(_pyrdown(pyrc[-1]))
+
+        scale = 2**levels
+        cnofs = [pyrp[-1].shape[0]-pyrc[-1].shape[0]+1,
+                 pyrp[-1].shape[1]-pyrc[-1].shape[1]+1]
+        ylim = _window(center[0], radius, scale, cnofs[0])
+        xlim = _window(center[1], radius, scale, cnofs[1])
+        imgpc = _ssdmap(pyrp[-1], pyrc[-1], ylim, xlim)
+        amin = np.unravel_index(np.argmin(imgpc), imgpc.shape)
+        amin = (amin[0]+ylim[0], amin[1]+xlim[0])
+
+        for lvl in range(levels-1, -1, -1):
+            lnofs = [pyrp[lvl].shape[0]-pyrc[lvl].shape[0]+1,
+                     pyrp[lvl].shape[1]-pyrc[lvl].shape[1]+1]
+            ylim = [max(0, 2*amin[0]-2), min(lnofs[0], 2*amin[0]+3)]
+            xlim = [max(0, 2*amin[1]-2), min(lnofs[1], 2*amin[1]+3)]
+            imgpc = _ssdwin(pyrp[lvl], pyrc[lvl], ylim, xlim)
+            amin = np.unravel_index(np.argmin(imgpc), imgpc.shape)
+            amin = (amin[0]+ylim[0], amin[1]+xlim[0])
+    else:
+        raise ValueError(f'Unknown alignment method {method}.')
+
+    crop = imgp[amin[0]:(amin[0]+imgc.shape[0]),
                 amin[1]:(amin[1]+imgc.shape[1]), :]
+    return (crop, [int(amin[0])-_py, int(amin[1])-_px]) if retoff else crop
 
 
 # Hardcoded colormap to avoid dependency on matplotlib
@@ -77,3 +203,11 @@ CMAP = np.reshape([0.12156, 0.4666, 0.7058, 0.6823, 0.7803, 0.9098,
                    0.792, 0.7333, 0.6058, 0.6607, 0.6392, 0.6392, 0.6392,
                    0.7588, 0.7607, 0.4568, 0.7980, 0.8, 0.3431, 0.4745, 0.8019,
                    0.6823, 0.35490, 0.8, 0.8549019607843138], [39, 3])
+
+# visualize() output for every channel, pixel value, and color (with color
+# 0 for background and k for CMAP[k-1]), computed with _fvisualize.
+_VIZTABLE = np.ascontiguousarray(_fvisualize(
+    np.repeat(np.arange(256, dtype=np.uint8)[:, None, None],
+              CMAP.shape[0]+1, 1).repeat(3, 2),
+    np.repeat(np.r_[0, np.arange(CMAP.shape[0]) + CMAP.shape[0]][None, :],
+              256, 0)).transpose(2, 0, 1)).reshape(3, -1)
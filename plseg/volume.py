@@ -0,0 +1,284 @@
+"""Write and read H x W x N label volumes one frame at a time."""
+
+import os
+import queue
+import zipfile
+import threading
+import numpy as np
+from .stack import Stack, StackWriter
+from .sparse import SparseLabels, SparseWriter
+
+
+def narrowest(lmin, lmax):
+    """Smallest integer dtype that can store labels in [lmin, lmax]."""
+    for dtype in [np.uint8, np.uint16, np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= lmin and lmax <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def npzdtype(lmax):
+    """Dtype used for labels.npz (for compatibility with earlier files)."""
+    return np.dtype(np.uint8) if lmax <= 255 else np.dtype(np.int16)
+
+
+class LabelWriter:
+    """Stream label frames to a stack file, each in its narrowest dtype."""
+
+    def __init__(self, fname, append=False, keep=None):
+        self.stack = StackWriter(fname, append, keep)
+        self.shape, self.lmax = None, 0
+        if self.stack.nframes > 0:
+            store = LabelStore(fname)
+            self.shape = store.shape[:2]
+            self.lmax = max(int(np.amax(f)) for f in store)
+
+    @property
+    def nframes(self):
+        """Number of frames written so far."""
+        return self.stack.nframes
+
+    def append(self, seg):
+        """Write next label frame."""
+        if self.shape is None:
+            self.shape = seg.shape
+        elif seg.shape != self.shape:
+            raise ValueError(f'Expected {self.shape} frame, got {seg.shape}.')
+        lmin, lmax = int(np.amin(seg)), int(np.amax(seg))
+        self.lmax = max(self.lmax, lmax)
+        self.stack.append(seg.astype(narrowest(lmin, lmax), copy=False))
+
+    def flush(self):
+        """Make sure all frames written so far are on disk."""
+        self.stack.flush()
+
+    def close(self):
+        """Finish writing."""
+        self.stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LabelStore(Stack):
+    """Lazily read label volume from a stack file, one frame at a time.
+
+    Besides integer indexing by frame, supports indexing like an H x W x N
+    array as long as a single frame is selected, e.g., store[y1:y2, :, t].
+    """
+
+    def __init__(self, fname):
+        super().__init__(fname)
+        shape = self.metas[0]['shape'] if len(self) > 0 else [0, 0]
+        self.shape = (shape[0], shape[1], len(self))
+
+    def frame(self, idx):
+        """Get label image of frame idx."""
+        return super().__getitem__(idx)
+
+    def toarray(self):
+        """Read whole volume as an array, with the dtype of labels.npz."""
+        frames = list(self)
+        lmax = max([int(np.amax(_f)) for _f in frames if _f.size] + [0])
+        labels = np.empty(self.shape, npzdtype(lmax), order='F')
+        for _t, frame in enumerate(frames):
+            labels[:, :, _t] = frame
+        return labels
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple):
+            return self.frame(idx[2])[idx[:2]]
+        return self.frame(idx)
+
+
+def savenpz(fname, frames, shape, dtype, name='labels'):
+    """Write H x W x N volume to npz, one H x W frame at a time.
+
+    The array is stored in Fortran order so that frames can be written as
+    they come, without ever holding the whole volume in memory. It loads
+    with np.load exactly as a C-ordered array would.
+    """
+    dtype = np.dtype(dtype)
+    header = {'descr': np.lib.format.dtype_to_descr(dtype),
+              'fortran_order': True, 'shape': tuple(shape)}
+    with zipfile.ZipFile(fname, 'w', zipfile.ZIP_DEFLATED,
+                         allowZip64=True) as _zf:
+        with _zf.open(name+'.npy', 'w', force_zip64=True) as _f:
+            np.lib.format.write_array_header_1_0(_f, header)
+            for frame in frames:
+                _f.write(np.ascontiguousarray(frame.T, dtype).data)
+
+
+def addnpz(fname, **arrays):
+    """Add arrays to an existing npz file."""
+    with zipfile.ZipFile(fname, 'a', zipfile.ZIP_DEFLATED,
+                         allowZip64=True) as _zf:
+        for name, arr in arrays.items():
+            with _zf.open(name+'.npy', 'w', force_zip64=True) as _f:
+                np.lib.format.write_array(_f, np.asanyarray(arr),
+                                          allow_pickle=False)
+
+
+_CHUNK = 16*2**20
+_LOCK = threading.Lock()
+_LOCKS = {}
+
+
+def sidecar(fname):
+    """Name of uncompressed copy of the labels in an npz file."""
+    return fname[:-4] + '.mmap.npy'
+
+
+def _unpack(fname, sname):
+    """Stream labels from npz file to a Fortran-ordered .npy file."""
+    with zipfile.ZipFile(fname) as _zf, _zf.open('labels.npy') as _f:
+        major, _ = np.lib.format.read_magic(_f)
+        shape, fortran, dtype = getattr(
+            np.lib.format, f'read_array_header_{major}_0')(_f)
+        if len(shape) != 3:
+            raise ValueError(f'Expected H x W x N labels, got {shape}.')
+
+        tmpname = f'{sname}.{os.getpid()}.tmp'
+        out = np.lib.format.open_memmap(tmpname, 'w+', dtype, shape,
+                                        fortran_order=True)
+        if fortran:
+            buf = memoryview(out.reshape(-1, order='F').view(np.uint8))
+            pos = 0
+            while pos < len(buf):
+                nread = _f.readinto(buf[pos:pos+_CHUNK])
+                if not nread:
+                    raise ValueError(f'Truncated labels in {fname}.')
+                pos += nread
+        else:
+            rowsz = shape[1]*shape[2]*dtype.itemsize
+            step = max(1, _CHUNK // rowsz)
+            for _y in range(0, shape[0], step):
+                rows = min(step, shape[0]-_y)
+                data = _f.read(rows*rowsz)
+                if len(data) != rows*rowsz:
+                    raise ValueError(f'Truncated labels in {fname}.')
+                data = np.frombuffer(data, dtype).reshape((rows,)+shape[1:])
+                # Transposing narrow blocks is much faster than all at once.
+                for _x in range(0, shape[1], 16):
+                    out[_y:_y+rows, _x:_x+16] = data[:, _x:_x+16]
+        out.flush()
+        del out
+    os.replace(tmpname, sname)
+
+
+def mmap(fname):
+    """Memory-map labels in an npz file, without decompressing all of it.
+
+    The labels are copied (one chunk at a time) to an uncompressed sidecar
+    file, in an order where every frame is contiguous, the first time this
+    is called, or if the npz file has changed since. The map is copy on
+    write: changes to the returned array are never saved to the sidecar.
+    """
+    sname = sidecar(fname)
+    with _LOCK:
+        lock = _LOCKS.setdefault(sname, threading.Lock())
+    with lock:
+        if not os.path.isfile(sname) or \
+           os.stat(sname).st_mtime_ns < os.stat(fname).st_mtime_ns:
+            _unpack(fname, sname)
+    return np.load(sname, mmap_mode='c')
+
+
+def find(tdir, name='labels', exts=('npz', 'plr', 'stk')):
+    """Get the most recently saved of name.ext label files, if any."""
+    fnames = [f'{tdir}/{name}.{_e}' for _e in exts]
+    fnames = [_f for _f in fnames if os.path.isfile(_f)]
+    if len(fnames) == 0:
+        return None
+    return max(fnames, key=os.path.getmtime)
+
+
+def load(fname, lazy=False):
+    """Load label volume from npz, .plr (see plseg.sparse), or stack file.
+
+    If lazy is True, npz files are memory-mapped (see mmap) when possible.
+    """
+    if fname.endswith('.plr'):
+        return SparseLabels(fname)
+    if fname.endswith('.npz'):
+        if lazy:
+            try:
+                return mmap(fname)
+            except (OSError, ValueError):
+                pass
+        return np.load(fname)['labels']
+    return LabelStore(fname)
+
+
+def tosparse(fname, sname):
+    """Convert label volume (in any format) to a .plr file."""
+    labels = load(fname)
+    dtype = getattr(labels, 'dtype', None)
+    if dtype is None:  # Frames of stack files each have their own dtype
+        dtype = npzdtype(max([int(np.amax(_f)) for _f in labels] + [0]))
+    with SparseWriter(sname, dtype) as writer:
+        for _t in range(labels.shape[-1]):
+            writer.append(labels[:, :, _t])
+
+
+def todense(sname, fname):
+    """Convert .plr file to an npz file (as saved by plabel.py)."""
+    labels = SparseLabels(sname)
+    savenpz(fname, (labels.frame(_t) for _t in range(len(labels))),
+            labels.shape, labels.dtype)
+
+
+def editable(fname):
+    """Load label volume to edit, reading stack files into an array."""
+    labels = load(fname, lazy=True)
+    if isinstance(labels, LabelStore):
+        labels = labels.toarray()
+    return labels
+
+
+class Prefetcher:
+    """Prepare label files that are likely to be loaded next, in background.
+
+    Creates their memory-mapping sidecars, and reads sidecars into the OS
+    page cache as long as their total size is within budget bytes.
+    """
+
+    def __init__(self, budget=2**31):
+        self.budget = budget
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def request(self, fnames):
+        """Prefetch list of files, in order (dropping earlier requests).
+
+        Names that are None (e.g., from find with no labels) are skipped.
+        """
+        self.queue.put([f for f in fnames if f is not None])
+
+    def _run(self):
+        buf = bytearray(_CHUNK)
+        while True:
+            fnames = self.queue.get()
+            while not self.queue.empty():
+                fnames = self.queue.get()
+            left = self.budget
+            for fname in fnames:
+                if not self.queue.empty():
+                    break
+                if not fname.endswith('.npz'):
+                    continue
+                try:
+                    mmap(fname)
+                    size = os.path.getsize(sidecar(fname))
+                    if size > left:
+                        continue
+                    left -= size
+                    with open(sidecar(fname), 'rb') as _f:
+                        while _f.readinto(buf):
+                            pass
+                except (OSError, ValueError):
+                    pass
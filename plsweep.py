@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Segment a sequence with many segmentation options in a single pass."""
+
+import sys
+import os
+import json
+import shutil
+import argparse
+from functools import partial
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from skimage.io import imsave
+import plseg.label as plbl
+import plseg.utils as ut
+import plseg.volume as vol
+import plseg.sweep as sw
+from plseg.pipeline import prefetch, Writer
+from plabel import loadopts, outname, savelabels
+
+
+def getargopts():
+    """Parse command line arguments."""
+    opts = argparse.ArgumentParser(
+        description='Segment a sequence with many different segmentation '
+        + 'options, sharing decoding, alignment, and cost computations. '
+        + 'See SEGOPT.md for instructions.')
+    opts.add_argument('--out', default=None,
+                      help="Base directory for results (default: sweep "
+                      + "sub-directory of target)")
+    opts.add_argument('--threads', type=int, default=os.cpu_count(),
+                      help="Number of options to segment each frame with "
+                      + "in parallel (default: number of cores)")
+    opts.add_argument('--prefetch', type=int, default=4,
+                      help="Number of frames to read ahead, and of image "
+                      + "saves to queue, in background threads (default 4, "
+                      + "0 to disable)")
+    opts.add_argument('--labels', choices=['npz', 'stack', 'both'],
+                      default='npz',
+                      help="Format to save labels in (see plabel.py).")
+    opts.add_argument('--align', choices=['full', 'pyramid'],
+                      default='full', help="Alignment search method.")
+    opts.add_argument('--align-radius', type=int, default=None,
+                      help="Only search for alignment within these many "
+                      + "pixels of the previous frame's offset.")
+    opts.add_argument('target', help="Target directory with caopt.json.")
+    opts.add_argument('sweep', help="JSON file with either a list of "
+                      + "options, or lists of values of some options to "
+                      + "try every combination of.")
+    args = opts.parse_args()
+    args.target = args.target.rstrip('/')
+
+    if not os.path.isfile(args.target+'/caopt.json'):
+        sys.stderr.write(f'{args.target}/caopt.json does not exist.\n')
+        sys.stderr.write('See README.md for instructions.\n')
+        sys.exit(255)
+
+    return args
+
+
+def loadsweep(fname, base):
+    """Load list of options to sweep over, relative to base options."""
+    with open(fname, 'r') as _f:
+        sweep = json.load(_f)
+    if isinstance(sweep, dict):
+        return sw.grid(base, sweep)
+    return [plbl.Options(**dict(asdict(base), **sopt)) for sopt in sweep]
+
+
+def _savecrop(fnames, imgc):
+    """Save crop once, and link (or copy) it to every other file name."""
+    imsave(fnames[0], imgc)
+    for fname in fnames[1:]:
+        if os.path.lexists(fname):
+            os.remove(fname)
+        try:
+            os.link(fnames[0], fname)
+        except OSError:
+            shutil.copyfile(fnames[0], fname)
+
+
+def dosweep(srcdir, tgtdir, scale, skip, alims, base, opts, outdir=None,
+            progress=True, depth=4, nthreads=1, lformat='npz',
+            align='full', aradius=None):
+    """Segment sequence with every options in opts.
+
+    Results for each options are saved in a sub-directory of outdir
+    (default: tgtdir/sweep), named by fields that differ from base, along
+    with the caopt.json and segopt.json to reproduce them with plabel.py.
+    Frames are decoded and aligned once, and unary and pairwise costs are
+    only computed once per frame for options that share them.
+    """
+
+    outdir = outdir or tgtdir+'/sweep'
+    names = [sw.confname(opt, base) for opt in opts]
+    if len(set(names)) < len(names):
+        raise ValueError('Sweep has repeated options.')
+
+    with open(tgtdir+'/caopt.json', 'r') as _f:
+        caopt = json.load(_f)
+    odirs = [f'{outdir}/{name}' for name in names]
+    for odir, opt in zip(odirs, opts):
+        os.makedirs(odir, exist_ok=True)
+        with open(odir+'/caopt.json', 'w') as _f:
+            json.dump(caopt, _f)
+        with open(odir+'/segopt.json', 'w') as _f:
+            json.dump(asdict(opt), _f)
+
+    flist = ut.getimglist(srcdir)
+    if skip > 0:
+        flist = flist[skip:]
+
+    def _saveseg(fname, imgc, seg):
+        imsave(fname, ut.visualize(imgc, seg), check_contrast=False)
+
+    labels = [vol.LabelWriter(f'{odir}/labels.part.stk') for odir in odirs]
+    segs, imgc, offset = [None]*len(opts), None, None
+    frames = prefetch(partial(ut.imread, factor=scale), flist, depth)
+    with Writer(depth) as writer, ThreadPoolExecutor(nthreads) as pool:
+        for i, img in enumerate(tqdm(frames, total=len(flist),
+                                     disable=not progress)):
+            ofn, oext = outname(flist[i])
+
+            if i == 0:
+                imgc = img[alims[0][0]:alims[0][1],
+                           alims[1][0]:alims[1][1], :]
+                offset = [alims[0][0], alims[1][0]]
+            else:
+                imgc, offset = ut.crop_align(
+                    img, imgc, align, offset,
+                    aradius if offset is not None else None, retoff=True)
+            writer.submit(_savecrop, [f'{odir}/{ofn}-crop.{oext}'
+                                      for odir in odirs], imgc)
+
+            feats = sw.sharedfeatures(imgc, opts)
+            segs = list(pool.map(partial(plbl.label, imgc), segs, opts,
+                                 feats))
+            for odir, seg, lwriter in zip(odirs, segs, labels):
+                lwriter.append(seg)
+                writer.submit(_saveseg, f'{odir}/{ofn}-seg.{oext}',
+                              imgc, seg)
+
+    for odir, lwriter in zip(odirs, labels):
+        lwriter.close()
+        savelabels(odir, lwriter.lmax, lformat)
+
+    return odirs
+
+
+if __name__ == "__main__":
+    ARGS = getargopts()
+    SOPTS = loadopts(ARGS.target)
+    OPTS = loadsweep(ARGS.sweep, SOPTS[-1])
+    print(f'Segmenting {ARGS.target} with {len(OPTS)} sets of options.')
+    dosweep(*SOPTS, OPTS, outdir=ARGS.out, depth=ARGS.prefetch,
+            nthreads=ARGS.threads, lformat=ARGS.labels, align=ARGS.align,
+            aradius=ARGS.align_radius)
@@ -0,0 +1,31 @@
+"""Check the fast unary cost against the full Lab conversion."""
+
+import numpy as np
+import pytest
+from skimage.color import rgb2lab
+from plseg.costs import achannel, unary, unarylab, unarytol
+from plseg.label import Options
+
+
+def colors():
+    """Grid of 8-bit colors (every 5th level, and the extremes)."""
+    levels = np.r_[np.arange(0, 256, 5), 254, 255]
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), -1)
+    return grid.reshape(len(levels), -1, 3).astype(np.uint8)
+
+
+def test_achannel():
+    """a* agrees with rgb2lab to within the documented bound."""
+    img = colors()
+    err = np.abs(np.float64(achannel(img)) - rgb2lab(img)[:, :, 1])
+    assert np.amax(err) <= 1.2e-4
+
+
+@pytest.mark.parametrize('grthresh', [-10, 8, 20])
+@pytest.mark.parametrize('grsensitivity', [1, 2, 4, 16])
+def test_unary(grthresh, grsensitivity):
+    """unary agrees with unarylab to within unarytol."""
+    img = colors()
+    opt = Options(grthresh=grthresh, grsensitivity=grsensitivity)
+    err = np.abs(np.float64(unary(img, opt)) - unarylab(img, opt))
+    assert np.amax(err) <= unarytol(opt)
@@ -3,49 +3,98 @@
 """Create visualiations of cleaned up segmentations."""
 
 import sys
+import os
+import argparse
 from glob import glob
+from multiprocessing import Pool
 from tqdm import tqdm
 import numpy as np
-from skimage.io import imread, imsave
+from skimage.io import imsave
 import plseg.utils as ut
+import plseg.volume as vol
+from plseg.frames import Frames
+from plseg.pipeline import Writer
 
 
 def getargopts():
-    """Get directory list base on command line."""
+    """Parse command line arguments."""
+    opts = argparse.ArgumentParser(
+        description='Generate visualizations of cleaned up segmentations. '
+        + 'See README.md for instructions.')
+    opts.add_argument('--workers', type=int, default=os.cpu_count(),
+                      help="Number of sequences to visualize in parallel "
+                      + "(default: number of cores)")
+    opts.add_argument('--force', action='store_true',
+                      help="Also re-create visualizations that are newer "
+                      + "than their labels.")
+    opts.add_argument('target', help="Base target directory.")
+    args = opts.parse_args()
 
-    if len(sys.argv) != 2:
-        sys.stderr.write(f'USAGE: {sys.argv[0]} base_target_dir\n')
-        sys.stderr.write('Generate visualizations of '
-                         + 'cleaned up segmentations.\n')
-        sys.stderr.write('See README.md for instructions.\n')
-        sys.exit(255)
-
-    tgtdir = sys.argv[1].rstrip('/')
+    tgtdir = args.target.rstrip('/')
     dlist = sorted(glob(tgtdir+'/*/clean.npz'))
-    dlist = ['/'.join(d.split('/')[:-1]) for d in dlist]
+    args.dlist = ['/'.join(d.split('/')[:-1]) for d in dlist]
+
+    return args
+
+
+def outnames(tdir, crops):
+    """Names of -cseg images of all frames in a sequence."""
+    return [f'{tdir}/{crops.fname(_j, "cseg")}' for _j in range(len(crops))]
+
 
-    return dlist
+def isdone(tdir):
+    """Check if all -cseg images are newer than the labels they show.
 
+    Sequences must have a labels file (see plseg.volume.find).
+    """
+    outfs = outnames(tdir, Frames(tdir))
+    if len(outfs) == 0 or not all(os.path.isfile(f) for f in outfs):
+        return False
+    return min(os.path.getmtime(f) for f in outfs) > \
+        max(os.path.getmtime(f) for f in [vol.find(tdir), tdir+'/clean.npz'])
 
-def vizcseg(dlist):
-    """Main visualize loop."""
 
-    for _d in tqdm(dlist):
-        cropfs = sorted(glob(_d + '/*-crop.*'))
-        outfs = [fn.replace("-crop", "-cseg") for fn in cropfs]
+def vizone(tdir, depth=4):
+    """Visualize cleaned up segmentation of one sequence."""
 
-        origl = np.load(_d+'/labels.npz')['labels']
-        cnpz = np.load(_d+'/clean.npz')
-        newl = cnpz['labels']
-        removed = cnpz['removed']
+    crops = Frames(tdir)
+    outfs = outnames(tdir, crops)
 
+    origl = vol.load(vol.find(tdir))
+    cnpz = np.load(tdir+'/clean.npz')
+    newl = cnpz['labels']
+    removed = [int(_k) for _k in cnpz['removed']]
+
+    with Writer(depth) as writer:
         for _j in range(newl.shape[-1]):
-            base = imread(cropfs[_j])
-            viz = ut.visualize(base, newl[:, :, _j])
-            for _k in removed:
-                viz[origl[:, :, _j] == _k, :] = 0
-            imsave(outfs[_j], viz, check_contrast=False)
+            viz = ut.visualize(crops[_j], newl[:, :, _j])
+            orig = origl[:, :, _j]
+            if len(removed) > 0:
+                gone = np.zeros((max([int(np.amax(orig))]+removed)+1,), bool)
+                gone[[_k for _k in removed if _k >= 0]] = True
+                viz[gone[orig], :] = 0
+            writer.submit(imsave, outfs[_j], viz, check_contrast=False)
+
+
+def vizcseg(dlist, nworkers=1, force=False):
+    """Main visualize loop, skipping sequences that are done unless force."""
+
+    for tdir in [d for d in dlist if vol.find(d) is None]:
+        sys.stderr.write(f'{tdir}: no labels file found, skipping.\n')
+    dlist = [d for d in dlist if vol.find(d) is not None]
+    todo = [d for d in dlist if force or not isdone(d)]
+    print(f'Found {len(dlist)} sequences, {len(dlist)-len(todo)} '
+          + 'already done, visualizing the rest.')
+
+    if nworkers <= 1 or len(todo) <= 1:
+        for tdir in tqdm(todo):
+            vizone(tdir)
+        return
+    with Pool(min(nworkers, len(todo))) as pool:
+        for _ in tqdm(pool.imap_unordered(vizone, todo), total=len(todo)):
+            pass
 
 
 if __name__ == "__main__":
-    vizcseg(getargopts())
+    ARGS = getargopts()
+    vizcseg(ARGS.dlist, ARGS.workers, ARGS.force)